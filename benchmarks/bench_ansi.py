@@ -0,0 +1,63 @@
+"""Micro-benchmark of ANSI serialization on colorful ANSI-art mails.
+
+Usage: ``python benchmarks/bench_ansi.py [--screens N]``
+"""
+import argparse
+import random
+import timeit
+
+from ptt_mail_backup.ansi import chars_to_bytes
+from ptt_mail_backup.article import ArticleLine
+from ptt_mail_backup.ptt_bot import PTTBot
+
+FG = ["30", "31", "32", "33", "34", "35", "36", "37"]
+BG = ["40", "41", "42", "43", "44", "45", "46", "47"]
+
+def ansi_art_screen(rng):
+    """Generate a screen of ANSI art. Colors change every few cells, like
+    typical colorful mails."""
+    out = []
+    for _i in range(23):
+        col = 0
+        while col < 78:
+            codes = [rng.choice(FG), rng.choice(BG)]
+            if rng.random() < 0.2:
+                codes.insert(0, "1")
+            if rng.random() < 0.1:
+                codes.insert(0, "5")
+            out.append("\x1b[0;{}m".format(";".join(codes)).encode())
+            size = rng.randrange(1, 6)
+            out.append(rng.choice(["█", "▇", "◢", "◣", "　"]).encode("big5-uao") * size)
+            col += size * 2
+        out.append(b"\x1b[m\r\n")
+    return b"".join(out)
+
+def get_lines(screens, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for _i in range(screens):
+        bot = PTTBot(None)
+        bot.stream.feed(ansi_art_screen(rng))
+        lines.extend([*bot.lines(raw=True)][:-1])
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--screens", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = get_lines(args.screens)
+    packed = [ArticleLine(line) for line in lines]
+    assert [chars_to_bytes(l) for l in lines] == [p.to_bytes() for p in packed]
+
+    print("{} lines".format(len(lines)))
+    for name, func in [
+        ("chars_to_bytes", lambda: [chars_to_bytes(l) for l in lines]),
+        ("ArticleLine.to_bytes", lambda: [p.to_bytes() for p in packed]),
+    ]:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print("{:<24}{:8.2f} ms".format(name, best * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Measure startup time and the cost of matching login screens.
+
+* ``import``: ``import ptt_mail_backup`` in a new interpreter, from
+  ``-X importtime``.
+* ``--help``: wall time of ``python -m ptt_mail_backup --help``.
+* Per packet: the login and after-login handlers on typical screens.
+  ``encode`` encodes and searches each marker per packet like the handlers
+  used to do. ``markers`` uses the precompiled marker tables.
+
+Usage: ``python benchmarks/bench_login.py [--runs N]``
+"""
+import argparse
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+from ptt_mail_backup.fake_server import FakePTT, sample_mails
+from ptt_mail_backup.ptt_bot import (
+    AFTER_LOGIN_MARKERS, LOGIN_MARKERS, LOGIN_VIEWS, find_markers
+)
+
+def import_time(runs):
+    best = None
+    for _i in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import ptt_mail_backup"],
+            stderr=subprocess.PIPE, check=True, universal_newlines=True
+        )
+        for line in result.stderr.splitlines():
+            _self, cumulative, name = line.split("|")
+            if name.strip() == "ptt_mail_backup":
+                us = int(cumulative)
+                best = us if best is None else min(best, us)
+    return best / 1e6
+
+def help_time(runs):
+    best = None
+    for _i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "ptt_mail_backup", "--help"],
+            stdout=subprocess.DEVNULL, check=True
+        )
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def get_packets():
+    """Screens received while logging in. Most of them don't match any
+    marker."""
+    ptt = FakePTT(sample_mails(20))
+    ptt.cursor = 1
+    return [
+        ptt.connect(),
+        ptt.screen(["您要刪除以上錯誤嘗試的記錄嗎? [Y/n]"]),
+        ptt.screen(LOGIN_VIEWS),
+        ptt.main_menu(),
+        ptt.mail_list(),
+        ptt.enter_article(),
+    ]
+
+def encode_login(data):
+    found = set()
+    if "刪除其他重複登入".encode("big5-uao") in data:
+        found.add("duplicate")
+    if "密碼不對喔！".encode("big5-uao") in data:
+        found.add("wrong_password")
+    return found
+
+def encode_after_login(data):
+    if "編輯器自動復原".encode("big5-uao") in data:
+        return "recover"
+    if "您要刪除以上錯誤嘗試的記錄嗎?".encode("big5-uao") in data:
+        return "login_attempts"
+    if re.search(r"您保存信件數目 \d+ 超出上限 \d+".encode("big5-uao"), data):
+        return "mailbox_full"
+    if "新看板，確定要加入我的最愛嗎".encode("big5-uao") in data:
+        return "new_board"
+    if any(view.encode("big5-uao") in data for view in LOGIN_VIEWS):
+        return "view"
+    return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("{:<24}{:8.1f} ms".format("import", import_time(args.runs) * 1000))
+    print("{:<24}{:8.1f} ms".format("--help", help_time(args.runs) * 1000))
+
+    packets = get_packets()
+    for data in packets:
+        assert encode_login(data) == find_markers(LOGIN_MARKERS, data)
+        assert encode_after_login(data) in find_markers(AFTER_LOGIN_MARKERS, data) | {None}
+    for name, func in [
+        ("login encode", lambda: [encode_login(d) for d in packets]),
+        ("login markers", lambda: [find_markers(LOGIN_MARKERS, d) for d in packets]),
+        ("after-login encode", lambda: [encode_after_login(d) for d in packets]),
+        ("after-login markers", lambda: [find_markers(AFTER_LOGIN_MARKERS, d) for d in packets]),
+    ]:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.runs))
+        print("{:<24}{:8.2f} us/packet".format(
+            name, best / args.number / len(packets) * 1e6
+        ))
+
+if __name__ == "__main__":
+    main()
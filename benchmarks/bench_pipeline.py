@@ -0,0 +1,143 @@
+"""Benchmark the screen-to-article pipeline on synthetic pmore screens.
+
+Stages:
+
+* ``feed``: ``ByteStream.feed`` of the raw screens.
+* ``screen_line``: ``ArticleScreenLine`` construction of the captured rows.
+* ``add_screen``: ``Article.add_screen`` of all pages in order.
+* ``to_bytes``: ``Article.to_bytes`` of the composed article.
+* ``chars_to_bytes``: ``chars_to_bytes`` of the captured rows.
+
+Usage::
+
+    python benchmarks/bench_pipeline.py --save results-0.6.0.json
+    python benchmarks/bench_pipeline.py --compare results-0.6.0.json
+
+Inputs only depend on ``--seed`` and ``--scale``, so results of different
+versions are comparable on the same machine.
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+from screens import KINDS, generate
+
+import ptt_mail_backup
+from ptt_mail_backup.ansi import chars_to_bytes
+from ptt_mail_backup.article import Article, ArticleScreenLine
+from ptt_mail_backup.ptt_bot import PTTBot
+
+STAGES = ["feed", "screen_line", "add_screen", "to_bytes", "chars_to_bytes"]
+
+def capture(pages):
+    """Feed the pages and return a list of ``(rows, y, x)``. The footer is
+    not included."""
+    bot = PTTBot(None)
+    screens = []
+    for data, y, x in pages:
+        bot.stream.feed(data)
+        screens.append(([*bot.lines(raw=True)][:-1], y, x))
+    return screens
+
+def compose(screens):
+    article = Article("1/01", "sysop", "benchmark")
+    for rows, y, x in screens:
+        article.add_screen(rows, y, x)
+    return article
+
+def bench_kind(kind, seed, scale, repeat):
+    """Return ``(sizes, results)``. Results are the best time in seconds of
+    each stage."""
+    pages = generate(kind, seed, scale)
+    screens = capture(pages)
+    article = compose(screens)
+    rows = [(row, y + i, x) for screen, y, x in screens for i, row in enumerate(screen)]
+
+    def feed():
+        bot = PTTBot(None)
+        for data, _y, _x in pages:
+            bot.stream.feed(data)
+
+    funcs = {
+        "feed": feed,
+        "screen_line": lambda: [ArticleScreenLine(*row) for row in rows],
+        "add_screen": lambda: compose(screens),
+        "to_bytes": article.to_bytes,
+        "chars_to_bytes": lambda: [chars_to_bytes(row) for row, _y, _x in rows],
+    }
+    results = {
+        stage: min(timeit.repeat(funcs[stage], number=1, repeat=repeat))
+        for stage in STAGES
+    }
+    sizes = {
+        "pages": len(pages),
+        "bytes": sum(len(data) for data, _y, _x in pages),
+        "lines": len(article.lines),
+    }
+    return sizes, results
+
+def compare(old, new):
+    lines = ["{:<8}{:<16}{:>10}{:>10}{:>8}".format("kind", "stage", "old ms", "new ms", "ratio")]
+    for kind, results in new["results"].items():
+        old_results = old["results"].get(kind)
+        if not old_results or old["sizes"].get(kind) != new["sizes"][kind]:
+            lines.append("{:<8}(inputs differ, skipped)".format(kind))
+            continue
+        for stage, seconds in results.items():
+            if stage not in old_results:
+                continue
+            lines.append("{:<8}{:<16}{:>10.2f}{:>10.2f}{:>8.2f}".format(
+                kind, stage, old_results[stage] * 1000, seconds * 1000,
+                seconds / old_results[stage]
+            ))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--kind", action="append", choices=list(KINDS),
+                        help="Default: all kinds")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Multiply the line count of each mail. Default: %(default)r")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="FILE", help="Save results as JSON.")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Compare with results saved by --save.")
+    args = parser.parse_args()
+
+    data = {
+        "version": ptt_mail_backup.__version__,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "sizes": {},
+        "results": {},
+    }
+    print("{:<8}{:>6}{:>8}{:>10}  {}".format(
+        "kind", "pages", "lines", "bytes", "  ".join("{:>14}".format(s) for s in STAGES)
+    ))
+    for kind in args.kind or KINDS:
+        sizes, results = bench_kind(kind, args.seed, args.scale, args.repeat)
+        data["sizes"][kind] = sizes
+        data["results"][kind] = results
+        print("{:<8}{:>6}{:>8}{:>10}  {}".format(
+            kind, sizes["pages"], sizes["lines"], sizes["bytes"],
+            "  ".join("{:>11.2f} ms".format(results[s] * 1000) for s in STAGES)
+        ))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print()
+        print("compare with {} ({})".format(old["version"], args.compare))
+        print(compare(old, data))
+
+if __name__ == "__main__":
+    main()
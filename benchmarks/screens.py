@@ -0,0 +1,112 @@
+"""Synthetic pmore screens for benchmarks.
+
+Mails are generated with a seeded RNG and rendered by
+:class:`ptt_mail_backup.fake_server.FakePTT`, so the screens are the same as
+what the bot receives from the fake server, and the same for every run.
+
+Kinds:
+
+* ``plain``: Big5 text and ASCII.
+* ``ansi``: ANSI art. Colors change every few cells.
+* ``blink``: blinking text and double-color glyphs i.e. the lead byte and
+  the trail byte of a Big5 char have different colors.
+* ``wide``: lines wider than the screen. Each page is also rendered with
+  horizontal shifts, with ``<``/``>`` truncation markers.
+* ``long``: a long plain text mail.
+"""
+import random
+
+from ptt_mail_backup.fake_server import FakePTT, PAGE_LINES, big5, make_mail
+
+FG = ["30", "31", "32", "33", "34", "35", "36", "37"]
+BG = ["40", "41", "42", "43", "44", "45", "46", "47"]
+
+WORDS = ["今天", "天氣", "很好", "我們", "一起", "去", "看", "電影", "吧", "謝謝", "。", "，"]
+
+# the shifts used by the bot. See PTTBot._get_article
+SHIFTS = [0, 72, 144]
+
+def plain_line(rng, width=78):
+    out = []
+    col = 0
+    while col < width - 8:
+        if rng.random() < 0.2:
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _i in range(rng.randrange(2, 8)))
+        else:
+            word = rng.choice(WORDS)
+        out.append(word)
+        col += len(big5(word))
+    return big5("".join(out))
+
+def ansi_line(rng, width=78):
+    out = []
+    col = 0
+    while col < width:
+        codes = [rng.choice(FG), rng.choice(BG)]
+        if rng.random() < 0.2:
+            codes.insert(0, "1")
+        out.append("\x1b[0;{}m".format(";".join(codes)).encode())
+        size = rng.randrange(1, 6)
+        out.append(big5(rng.choice(["█", "▇", "◢", "◣", "　"])) * size)
+        col += size * 2
+    return b"".join(out) + b"\x1b[m"
+
+def blink_line(rng, width=78):
+    out = []
+    col = 0
+    while col < width:
+        char = big5(rng.choice(["★", "☆", "愛", "心", "◆"]))
+        if rng.random() < 0.5:
+            # double-color glyph
+            out.append("\x1b[1;{}m".format(rng.choice(FG)).encode() + char[:1])
+            out.append("\x1b[{};{}m".format(rng.choice(FG), rng.choice(BG)).encode() + char[1:])
+        else:
+            out.append("\x1b[5;{}m".format(rng.choice(FG)).encode() + char)
+        out.append(b"\x1b[m")
+        col += 2
+    return b"".join(out)
+
+def wide_line(rng):
+    return plain_line(rng, width=rng.randrange(80, 220))
+
+KINDS = {
+    "plain": (plain_line, 200),
+    "ansi": (ansi_line, 200),
+    "blink": (blink_line, 200),
+    "wide": (wide_line, 100),
+    "long": (plain_line, 5000),
+}
+
+def generate_mail(kind, seed=0, scale=1):
+    """Generate a :class:`ptt_mail_backup.fake_server.Mail`. The body has
+    ``scale`` times the default line count of ``kind``."""
+    make_line, count = KINDS[kind]
+    rng = random.Random("{}:{}".format(kind, seed))
+    body = [make_line(rng) for _i in range(count * scale)]
+    return make_mail("1/01", "sysop", "benchmark {}".format(kind), body)
+
+def generate_pages(mail, shifts=None):
+    """Render the mail page by page like the bot reads it. Return a list of
+    ``(data, y, x)``. ``data`` is the raw screen, ``y`` is the article line of
+    the first row, and ``x`` is the article column of the first cell.
+
+    :arg list shifts: Horizontal shifts of each page. Default to ``[0]``.
+    """
+    ptt = FakePTT(mails=[mail])
+    ptt.mail = mail
+    pages = []
+    top = 0
+    while True:
+        ptt.goto(top)
+        for shift in shifts or [0]:
+            ptt.shift = shift
+            # the first shifted column is the truncation marker
+            pages.append((ptt.pager(), ptt.top, shift - 1 if shift else 0))
+        if ptt.top + PAGE_LINES >= len(mail.lines):
+            return pages
+        top = ptt.top + PAGE_LINES
+
+def generate(kind, seed=0, scale=1):
+    """Generate the pages of a mail of ``kind``."""
+    mail = generate_mail(kind, seed, scale)
+    return generate_pages(mail, SHIFTS if kind == "wide" else None)
@@ -1,4 +1,6 @@
+import threading
 from collections import namedtuple
+from itertools import groupby
 from .pyte.graphics import FG_ANSI, BG_ANSI
 
 fg2code = {name: str(key).encode("latin-1") for key, name in FG_ANSI.items()}
@@ -17,6 +19,23 @@ def char_to_color(char):
         fg, bg = bg, fg
     return ColorState(char.bold, char.blink, fg, bg)        
 
+# interned color states. The id 0 means an empty cell.
+COLORS = [None]
+COLOR_IDS = {}
+COLOR_LOCK = threading.Lock()
+
+def color_id(color):
+    """Return a small integer representing ``color``."""
+    try:
+        return COLOR_IDS[color]
+    except KeyError:
+        pass
+    with COLOR_LOCK:
+        if color not in COLOR_IDS:
+            COLOR_IDS[color] = len(COLORS)
+            COLORS.append(color)
+        return COLOR_IDS[color]
+
 def code_to_ansi(codes):
     return b"\x1b[" + b";".join(codes) + b"m"
     
@@ -61,3 +80,37 @@ def chars_to_bytes(chars):
     """Convert a list of :class:`pyte.screens.Char` into ansi escape sequence.
     """
     return b"".join(colored_sequence(chars))
+    
+def transition(from_id, to_id, cache={}): # pylint: disable=dangerous-default-value
+    """Return the escape sequence from color id ``from_id`` to ``to_id``.
+    Results are cached.
+    """
+    try:
+        return cache[from_id, to_id]
+    except KeyError:
+        cache[from_id, to_id] = diff(COLORS[to_id], COLORS[from_id])
+        return cache[from_id, to_id]
+    
+def cells_to_bytes(data, colors):
+    """Like :func:`chars_to_bytes` but takes a bytes-like ``data`` and a
+    sequence of color ids (see :func:`color_id`) of the same length.
+
+    Cells are encoded by runs of the same color.
+    """
+    out = []
+    default_id = color_id(DEFAULT_COLOR)
+    current_id = default_id
+    pos = 0
+    for next_id, run in groupby(colors):
+        size = sum(1 for _c in run)
+        if not next_id:
+            out.append(b" " * size)
+        else:
+            if next_id != current_id:
+                out.append(transition(current_id, next_id))
+                current_id = next_id
+            out.append(data[pos:pos + size])
+        pos += size
+    if current_id != default_id:
+        out.append(RESET)
+    return b"".join(out)
@@ -0,0 +1,234 @@
+"""Save mails into a single tar or zip archive.
+
+Mails are streamed into the archive as they arrive, so a large backup only
+creates one file, plus a sidecar index ``PATH.index.jsonl`` with a JSON
+line for each mail.
+
+Compressed tar archives (``.tar.gz``, ``.tar.bz2``, ``.tar.xz``,
+``.tar.zst``) compress each member separately. Concatenated streams are
+still valid for ``tar`` and other tools, and a member can be read with
+:func:`read_member` by seeking to the offset in the index. This is also how
+an archive is appended to in incremental backups. ``.tar.zst`` requires the
+``zstandard`` package.
+"""
+import bz2
+import gzip
+import io
+import json
+import lzma
+import tarfile
+import threading
+import time
+import zipfile
+from collections import namedtuple
+
+from .filename import get_filename
+from .ptt_bot import MailItem
+
+ArchiveEntry = namedtuple("ArchiveEntry", [
+    "name", "offset", "length", "size", "index", "date", "sender", "title",
+    "list_sender", "list_title", "hash"
+])
+
+# the end of a tar archive
+TAR_END = b"\0" * tarfile.BLOCKSIZE * 2
+
+def zstd_compress(data):
+    try:
+        # optional
+        import zstandard # pylint: disable=import-outside-toplevel,import-error
+    except ImportError:
+        raise Exception(
+            ".tar.zst archives require zstandard: pip install zstandard"
+        ) from None
+    return zstandard.ZstdCompressor().compress(data)
+
+def zstd_decompress(data):
+    import zstandard # pylint: disable=import-outside-toplevel,import-error
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+COMPRESSORS = {
+    ".tar": (None, None),
+    ".tar.gz": (gzip.compress, gzip.decompress),
+    ".tgz": (gzip.compress, gzip.decompress),
+    ".tar.bz2": (bz2.compress, bz2.decompress),
+    ".tar.xz": (lzma.compress, lzma.decompress),
+    ".tar.zst": (zstd_compress, zstd_decompress),
+}
+
+def get_format(path):
+    """Return ``.zip`` or a key of :data:`COMPRESSORS`."""
+    name = str(path).lower()
+    if name.endswith(".zip"):
+        return ".zip"
+    for ext in COMPRESSORS:
+        if name.endswith(ext):
+            return ext
+    raise Exception("unknown archive format: {}".format(path))
+
+def index_path(path):
+    return "{}.index.jsonl".format(path)
+
+def load_index(path):
+    """Read the index of an archive. Return a list of :class:`ArchiveEntry`."""
+    try:
+        with open(index_path(path), encoding="utf-8") as f:
+            return [
+                # indexes written before list_sender
+                ArchiveEntry(**{"list_sender": None, **json.loads(line)})
+                for line in f if line.strip()
+            ]
+    except FileNotFoundError:
+        return []
+
+def has_members(path, decompress=None):
+    """Return ``True`` if a tar archive exists and has members. Damaged
+    archives are assumed to have members."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data and decompress:
+            data = decompress(data)
+    except FileNotFoundError:
+        return False
+    except Exception: # pylint: disable=broad-except
+        return True
+    # an empty archive starts with the end of the archive
+    return bool(data[:tarfile.BLOCKSIZE].strip(b"\0"))
+
+def read_member(path, entry):
+    """Read the content of a mail from an archive.
+
+    :arg ArchiveEntry entry: An entry returned by :func:`load_index`.
+    """
+    fmt = get_format(path)
+    if fmt == ".zip":
+        with zipfile.ZipFile(str(path)) as archive:
+            return archive.read(entry.name)
+    with open(path, "rb") as f:
+        f.seek(entry.offset)
+        data = f.read(entry.length)
+    decompress = COMPRESSORS[fmt][1]
+    if decompress:
+        data = decompress(data)
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:") as archive:
+        return archive.extractfile(archive.next()).read()
+
+class ArchiveStore:
+    """Save mails to a tar or zip archive. See the module docs.
+
+    :arg bool incremental: Append to the archive and skip mail list items
+        that are already in the index. Otherwise the archive is replaced.
+    """
+    def __init__(self, path, filename_format, incremental=False):
+        self.path = path
+        self.filename_format = filename_format
+        self.incremental = incremental
+        self.format = get_format(path)
+        self.compress = COMPRESSORS.get(self.format, (None, None))[0]
+        self.lock = threading.Lock()
+        self.saved = set()
+        self.entries = entries = load_index(path) if incremental else []
+        for entry in entries:
+            self.saved.add(
+                (entry.date, entry.list_sender or entry.sender, entry.list_title)
+            )
+        if self.format == ".zip":
+            self.file = None
+            self.zip = zipfile.ZipFile( # pylint: disable=consider-using-with
+                str(path), "a" if incremental else "w", zipfile.ZIP_DEFLATED
+            )
+        else:
+            self.zip = None
+            if entries:
+                self.file = open(path, "r+b") # pylint: disable=consider-using-with
+                # drop the end of the archive
+                self.file.truncate(max(e.offset + e.length for e in entries))
+                self.file.seek(0, io.SEEK_END)
+            else:
+                if incremental and has_members(path, COMPRESSORS[self.format][1]):
+                    # don't replace a backup, e.g. with --verify
+                    raise Exception(
+                        "the index of {} is missing or empty. Restore {} or "
+                        "move the archive away".format(path, index_path(path))
+                    )
+                self.file = open(path, "wb") # pylint: disable=consider-using-with
+        self.index = open( # pylint: disable=consider-using-with
+            index_path(path), "a" if entries else "w", encoding="utf-8"
+        )
+
+    def is_saved(self, item):
+        if not self.incremental:
+            return False
+        index, date, sender, title = item
+        with self.lock:
+            saved = (date, sender, title) in self.saved
+        if saved:
+            print("Skip saved mail: {}".format(index))
+        return saved
+
+    def saved_items(self):
+        with self.lock:
+            return [
+                MailItem(
+                    e.index, e.date, e.list_sender or e.sender,
+                    e.list_title or e.title
+                )
+                for e in self.entries
+            ]
+
+    def save(self, writer, article, index, item=None):
+        with writer:
+            content = writer.read_bytes()
+        name = get_filename(content, article, index, self.filename_format)
+        if self.zip:
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with self.lock:
+                self.zip.writestr(info, content)
+                self.add_entry(
+                    name, info.header_offset, info.compress_size, content,
+                    article, index, item, writer.hash.hexdigest()
+                )
+            return
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mtime = time.time()
+        data = info.tobuf(tarfile.PAX_FORMAT, "utf-8") + content
+        data += b"\0" * (-len(data) % tarfile.BLOCKSIZE)
+        if self.compress:
+            # outside the lock. Compressors release the GIL
+            data = self.compress(data)
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(data)
+            self.add_entry(
+                name, offset, len(data), content, article, index, item,
+                writer.hash.hexdigest()
+            )
+
+    def add_entry(self, name, offset, length, content, article, index, item, sha1):
+        """Write an index line. The caller must hold :attr:`lock`."""
+        entry = ArchiveEntry(
+            name, offset, length, len(content), index, article.date,
+            article.sender, article.title, item[2] if item else None,
+            item[3] if item else None, sha1
+        )
+        self.index.write(json.dumps(entry._asdict(), ensure_ascii=False) + "\n")
+        self.index.flush()
+        self.entries.append(entry)
+        if item:
+            # the sender in the header differs for forwarded mails
+            self.saved.add((article.date, item[2], item[3]))
+
+    def close(self):
+        with self.lock:
+            if self.zip:
+                self.zip.close()
+            else:
+                data = TAR_END
+                if self.compress:
+                    data = self.compress(data)
+                self.file.write(data)
+                self.file.close()
+            self.index.close()
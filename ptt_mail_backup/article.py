@@ -1,8 +1,9 @@
-import uao
+import hashlib
+import os
+import tempfile
+from array import array
 
-from .ansi import chars_to_bytes
-
-uao.register_uao()
+from .ansi import cells_to_bytes, char_to_color, color_id
 
 def is_default(char):
     return not char.bold and char.fg == "default" and char.bg == "default"
@@ -10,6 +11,31 @@ def is_default(char):
 def is_truncated(char):
     return char.bold and char.data in {"<", ">"}
     
+def char_color_id(char, cache={}): # pylint: disable=dangerous-default-value
+    key = (char.fg, char.bg, char.bold, char.blink, char.reverse)
+    try:
+        return cache[key]
+    except KeyError:
+        cache[key] = color_id(char_to_color(char))
+        return cache[key]
+
+class ArticleLine:
+    """A line of an article. Characters are stored in a bytearray and colors
+    are stored in a parallel array of color ids. An empty cell has the color
+    id 0.
+    """
+    __slots__ = ("data", "colors")
+    
+    def __init__(self, chars=()):
+        self.data = bytearray("".join(c.data for c in chars).encode("latin-1"))
+        self.colors = array("H", (char_color_id(c) for c in chars))
+        
+    def __len__(self):
+        return len(self.colors)
+        
+    def to_bytes(self):
+        return cells_to_bytes(self.data, self.colors)
+        
 class ArticleScreenLine:
     def __init__(self, line, line_no, col_start):
         skip_start = 0
@@ -41,33 +67,99 @@ class ArticleScreen:
             for line_no, line in enumerate(lines, self.y)
         ]
         
+class ArticleWriter:
+    """Write article lines to a temporary file in ``dest``. Call
+    :meth:`commit` to move the file into place.
+
+    ``checkpoint`` is the first line of the last page flushed by
+    :meth:`Article.flush`. If the download is interrupted right after a
+    checkpoint, it can be resumed from that line.
+    """
+    def __init__(self, dest):
+        self.file = tempfile.NamedTemporaryFile( # pylint: disable=consider-using-with
+            dir=dest, prefix=".ptt-mail-", suffix=".part", delete=False
+        )
+        self.path = self.file.name
+        self.hash = hashlib.sha1()
+        self.line_count = 0
+        self.checkpoint = 0
+        
+    def can_resume(self):
+        return self.line_count == self.checkpoint
+        
+    def write_line(self, line):
+        if self.line_count:
+            line = b"\r\n" + line
+        self.file.write(line)
+        self.hash.update(line)
+        self.line_count += 1
+        
+    def read_bytes(self):
+        self.file.flush()
+        with open(self.path, "rb") as f:
+            return f.read()
+        
+    def commit(self, path):
+        self.file.close()
+        os.replace(self.path, path)
+        
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.file.closed:
+            self.abort()
+            
 class Article:
-    """Article composer. Compose multiple screens into an article."""
-    def __init__(self, date, sender, title):
+    """Article composer. Compose multiple screens into an article.
+
+    :arg ArticleWriter sink: If set, lines are written to the sink by
+        :meth:`flush` and dropped from memory. :meth:`to_bytes` is not
+        available in this case.
+    :arg int start_line: Lines before ``start_line`` are already written to
+        the sink.
+    :arg datetime time: The time in the article header, if available.
+
+    ``author`` and ``board`` are also read from the article header. They are
+    ``None`` if the header is missing.
+    """
+    def __init__(self, date, sender, title, sink=None, start_line=0, time=None):
         self.date = date
         self.sender = sender
         self.title = title
-        self.lines = []
-        
-    def draw_char(self, line_no, col_no, char):
-        if col_no >= len(self.lines[line_no]):
-            self.lines[line_no].extend([None] * (col_no - len(self.lines[line_no]) + 1))
-                
-        if self.lines[line_no][col_no] is None:
-            self.lines[line_no][col_no] = char
+        self.time = time
+        self.author = None
+        self.board = None
+        self.lines = [None] * start_line
+        self.sink = sink
+        self.flushed = start_line
         
     def draw_line(self, line):
         if line.line_no == len(self.lines) and line.col_no == 0:
             # no need to draw char but append the entire line
-            self.lines.append(line.chars)
+            self.lines.append(ArticleLine(line.chars))
             return
             
         if line.line_no >= len(self.lines):
             for _i in range(line.line_no - len(self.lines) + 1):
-                self.lines.append([])
-            
+                self.lines.append(ArticleLine())
+                
+        target = self.lines[line.line_no]
+        end = line.col_no + len(line.chars)
+        if end > len(target):
+            # pad with empty cells
+            target.data.extend(b" " * (end - len(target)))
+            target.colors.extend([0] * (end - len(target.colors)))
+        
+        # only draw empty cells
         for col_no, char in enumerate(line.chars, line.col_no):
-            self.draw_char(line.line_no, col_no, char)
+            if not target.colors[col_no]:
+                target.data[col_no] = ord(char.data)
+                target.colors[col_no] = char_color_id(char)
         
     def add_screen(self, lines, y, x, skip_line=None):
         screen = ArticleScreen(lines, y, x)
@@ -77,5 +169,22 @@ class Article:
             self.draw_line(line)
         return screen
         
+    def flush(self, line_no=None):
+        """Write lines before ``line_no`` (or all lines) to the sink. These
+        lines must not be drawn again. ``line_no`` should be the top line of
+        the current page, which is saved as the checkpoint of the sink.
+        """
+        if not self.sink:
+            return
+        page_top = line_no
+        if line_no is None:
+            line_no = len(self.lines)
+        for i in range(self.flushed, min(line_no, len(self.lines))):
+            self.sink.write_line(self.lines[i].to_bytes().rstrip())
+            self.lines[i] = None
+            self.flushed = i + 1
+        if page_top is not None:
+            self.sink.checkpoint = page_top
+        
     def to_bytes(self):
-        return b"\r\n".join(chars_to_bytes(l).rstrip() for l in self.lines)
+        return b"\r\n".join(l.to_bytes().rstrip() for l in self.lines)
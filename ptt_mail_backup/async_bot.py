@@ -0,0 +1,147 @@
+"""An asyncio driver of :class:`ptt_mail_backup.ptt_bot.BaseBot`.
+
+Many bots can run in one event loop::
+
+    async def backup(user, password, limiter):
+        async with async_ptt_login(user, password, limiter=limiter) as bot:
+            async with bot.enter_mail():
+                last_index = await bot.get_last_index()
+                ...
+
+    async def main():
+        limiter = RateLimiter(20)
+        await asyncio.gather(*(backup(u, p, limiter) for u, p in accounts))
+
+    asyncio.run(main())
+
+On Windows, paramiko channels only work with the selector event loop.
+"""
+import asyncio
+import functools
+import math
+import socket
+from contextlib import asynccontextmanager
+
+from .ptt_bot import BaseBot, guard_session
+from .recorder import RecordingChannel
+
+class RateLimiter:
+    """Limit the number of packets sent per second. A limiter could be
+    shared by many bots in the same event loop."""
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = 0
+
+    async def wait(self):
+        now = asyncio.get_event_loop().time()
+        delay = self.next_time - now
+        self.next_time = max(self.next_time, now) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+@asynccontextmanager
+async def async_ptt_login(user, password, host="ptt.cc", port=22, record=None,
+                          pipelining=True, limiter=None, stats=None):
+    """Like :func:`ptt_mail_backup.ptt_bot.ptt_login` but yield an
+    :class:`AsyncPTTBot`. ``user`` and ``password`` are required since
+    prompting would block the event loop.
+    """
+    from paramiko.client import SSHClient, AutoAddPolicy # pylint: disable=import-outside-toplevel
+    loop = asyncio.get_event_loop()
+    with SSHClient() as client:
+        client.set_missing_host_key_policy(AutoAddPolicy)
+        await loop.run_in_executor(None, functools.partial(
+            client.connect, host, port=port, username="bbs", password=""
+        ))
+        channel = await loop.run_in_executor(None, client.invoke_shell)
+        with channel:
+            channel.settimeout(0)
+            if record:
+                channel = RecordingChannel(channel, record, secrets=[password])
+            bot = AsyncPTTBot(
+                channel, pipelining=pipelining, limiter=limiter, stats=stats
+            )
+            with guard_session(bot):
+                await bot.login(user, password)
+                yield bot
+
+class AsyncPTTBot(BaseBot):
+    """A bot driven by asyncio. The channel must be non-blocking.
+
+    :arg RateLimiter limiter: Wait for the limiter before sending keys.
+    """
+    def __init__(self, channel, pipelining=True, limiter=None, timeout=10,
+                 stats=None):
+        super().__init__(channel, pipelining=pipelining, stats=stats, timeout=timeout)
+        self.limiter = limiter
+
+    async def run(self, steps):
+        """Drive a generator returned by the underscore methods. Return its
+        return value."""
+        try:
+            steps.send(None)
+            while True:
+                await self.write(self.pop_outbox())
+                steps.send(await self.recv())
+        except StopIteration as err:
+            await self.write(self.pop_outbox())
+            return err.value
+
+    async def write(self, data):
+        if not data:
+            return
+        if self.limiter:
+            await self.limiter.wait()
+        pos = 0
+        while pos < len(data):
+            try:
+                pos += self.channel.send(data[pos:])
+            except socket.timeout:
+                # the window is full
+                await asyncio.sleep(0.01)
+
+    async def recv(self):
+        loop = asyncio.get_event_loop()
+        while not self.channel.recv_ready():
+            if self.channel.eof_received or self.channel.closed:
+                raise EOFError("channel is closed")
+            ready = loop.create_future()
+            def on_ready(ready=ready):
+                if not ready.done():
+                    ready.set_result(None)
+            fd = self.channel.fileno()
+            loop.add_reader(fd, on_ready)
+            stalled = False
+            try:
+                await asyncio.wait_for(ready, self.recv_timeout())
+            except asyncio.TimeoutError:
+                stalled = True
+            finally:
+                loop.remove_reader(fd)
+            if stalled:
+                if self.on_stall():
+                    return b""
+                await self.write(self.pop_outbox())
+        return self.channel.recv(math.inf)
+
+    async def login(self, user, password):
+        return await self.run(self._login(user, password))
+
+    @asynccontextmanager
+    async def enter_mail(self):
+        await self.run(self._enter_mail())
+        yield
+        if not self.channel.closed:
+            await self.run(self._leave_mail())
+
+    async def get_last_index(self):
+        return await self.run(self._get_last_index())
+
+    async def get_item(self, index):
+        return await self.run(self._get_item(index))
+
+    async def scan_mailbox(self, start=1, end=None):
+        return await self.run(self._scan_mailbox(start, end))
+
+    async def get_article(self, index, sink=None, start_line=0):
+        return await self.run(self._get_article(index, sink=sink, start_line=start_line))
@@ -0,0 +1,213 @@
+"""Backup many accounts in one job.
+
+Accounts are listed in an INI file. Each section is an account, named by the
+user unless ``user`` is set. Keys are the long options of the command line,
+with underscores. ``range`` is a comma separated list of ``START END``, or
+``all``::
+
+    [DEFAULT]
+    range = all
+    filename_format = {index}. {title} ({time:%%Y%%m%%d}).ans
+
+    [alice]
+    password = secret
+    dest = backup/alice
+
+    [bob-work]
+    user = bob
+    password = secret
+    range = 1 100, -9 0
+    store = sqlite:bob.db
+
+Values in ``[DEFAULT]`` are shared by all accounts. Note that ``%`` must be
+escaped as ``%%``. Options given on the command line are also used as
+defaults, except ``user`` and ``password``, and ``dest`` defaults to
+``DEST/USER``.
+
+Run it with ``ptt-mail-backup --batch accounts.ini``. All accounts are
+incremental. At most ``--max-sessions`` SSH sessions are opened at the same
+time, and logins to the same host are at least ``--login-interval`` seconds
+apart.
+"""
+import argparse
+import configparser
+import pathlib
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from getpass import getpass
+
+from .cli import run_job
+from .stats import Stats
+
+STR_OPTIONS = {
+    "user", "password", "dest", "filename_format", "store", "host", "record",
+    "sender", "date", "title", "stats"
+}
+INT_OPTIONS = {"workers", "port", "retries"}
+BOOL_OPTIONS = {"no_pipeline"}
+
+class SessionSlot:
+    """A slot of :class:`SessionLimiter`, held while a session is connected.
+    :meth:`release` could be called more than once."""
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.semaphore.release()
+
+class SessionLimiter:
+    """Limit the number of SSH sessions and pace logins to each host.
+    Thread-safe.
+
+    :arg int max_sessions: The maximum number of sessions at the same time.
+    :arg float interval: The minimum time between logins to a host.
+    """
+    def __init__(self, max_sessions, interval=0):
+        self.semaphore = threading.BoundedSemaphore(max_sessions)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_login = {}
+
+    def acquire(self, host, timeout=None):
+        """Wait for a slot, then for the login interval of ``host``. Return a
+        :class:`SessionSlot`, or ``None`` if no slot is free in ``timeout``
+        seconds."""
+        if not self.semaphore.acquire(timeout=timeout): # pylint: disable=consider-using-with
+            return None
+        self.wait(host)
+        return SessionSlot(self.semaphore)
+
+    @contextmanager
+    def session(self, host):
+        slot = self.acquire(host)
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            login_at = max(self.next_login.get(host, 0), now)
+            self.next_login[host] = login_at + self.interval
+        time.sleep(login_at - now)
+
+def parse_ranges(text):
+    """Parse ``"1 100, -9 0"`` into ``[[1, 100], [-9, 0]]``. Return ``None``
+    for ``"all"``."""
+    if text.strip() == "all":
+        return None
+    ranges = []
+    for part in text.split(","):
+        start, end = part.split()
+        ranges.append([int(start), int(end)])
+    return ranges
+
+def load_accounts(path, defaults):
+    """Read the INI file and return a list of ``(name, args)``.
+
+    :arg argparse.Namespace defaults: Options from the command line.
+    """
+    config = configparser.ConfigParser()
+    with open(path, encoding="utf-8") as f:
+        config.read_file(f)
+    accounts = []
+    for name in config.sections():
+        section = config[name]
+        args = argparse.Namespace(**vars(defaults))
+        args.user = args.password = args.dest = None
+        for key in section:
+            if key in STR_OPTIONS:
+                setattr(args, key, section[key])
+            elif key in INT_OPTIONS:
+                setattr(args, key, section.getint(key))
+            elif key in BOOL_OPTIONS:
+                setattr(args, key, section.getboolean(key))
+            elif key == "range":
+                args.range = parse_ranges(section[key])
+                args.all = args.range is None
+            else:
+                raise Exception("[{}]: unknown option {!r}".format(name, key))
+        if not args.user:
+            args.user = name
+        if not args.all and not args.range:
+            raise Exception("[{}]: range is required".format(name))
+        if args.dest is None:
+            args.dest = str(pathlib.Path(defaults.dest) / args.user)
+        args.incremental = True
+        args.batch = None
+        accounts.append((name, args))
+    return accounts
+
+class AccountResult:
+    def __init__(self, name):
+        self.name = name
+        self.stats = Stats()
+        self.seconds = 0
+        self.error = None
+
+    def format(self):
+        line = "{:<16}{:>8}{:>9}{:>8}{:>10.1f}".format(
+            self.name, self.stats.saved, self.stats.skipped, self.stats.failed,
+            self.seconds
+        )
+        if self.error:
+            line += "  error: {!r}".format(self.error)
+        return line
+
+def run_account(args, result):
+    try:
+        run_job(args, stats=result.stats)
+    except Exception as err: # pylint: disable=broad-except
+        traceback.print_exc()
+        print("Account {} failed: {!r}".format(result.name, err))
+        result.error = err
+    finally:
+        result.seconds = time.perf_counter() - result.stats.start
+
+def format_summary(results):
+    lines = ["{:<16}{:>8}{:>9}{:>8}{:>10}".format(
+        "account", "saved", "skipped", "failed", "seconds"
+    )]
+    lines.extend(result.format() for result in results)
+    lines.append("{:<16}{:>8}{:>9}{:>8}".format(
+        "total",
+        sum(r.stats.saved for r in results),
+        sum(r.stats.skipped for r in results),
+        sum(r.stats.failed for r in results)
+    ))
+    failed = [r.name for r in results if r.error]
+    if failed:
+        lines.append("{} of {} accounts failed: {}".format(
+            len(failed), len(results), ", ".join(failed)
+        ))
+    return "\n".join(lines)
+
+def run_batch(args):
+    """Backup accounts listed in ``args.batch`` and print a summary. Return
+    the exit code."""
+    accounts = load_accounts(args.batch, args)
+    limiter = SessionLimiter(args.max_sessions, args.login_interval)
+    results = []
+    threads = []
+    for name, account_args in accounts:
+        # prompt before starting threads
+        if not account_args.password:
+            account_args.password = getpass("Password of {}: ".format(account_args.user))
+        account_args.limiter = limiter
+        result = AccountResult(name)
+        results.append(result)
+        threads.append(threading.Thread(
+            target=run_account, args=(account_args, result), daemon=True
+        ))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(format_summary(results))
+    return 1 if any(r.error for r in results) else 0
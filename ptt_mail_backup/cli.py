@@ -0,0 +1,445 @@
+"""Parse the command line and run backup jobs. Used by the ``ptt-mail-backup``
+command, :mod:`ptt_mail_backup.daemon`, and :mod:`ptt_mail_backup.batch`.
+"""
+import argparse
+import pathlib
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from getpass import getpass
+
+from .article import ArticleWriter
+from .mail_index import compare_items, filter_items, format_comparison, save_index
+from .manifest import MANIFEST_NAME, Manifest
+from .ptt_bot import ptt_login, LoginError
+from .stats import Stats
+from .store import BackgroundStore, open_store
+
+# seconds between checks of the mail queue while waiting for a session slot
+SLOT_POLL_INTERVAL = 0.5
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Backup PTT mail.",
+        epilog="Run 'ptt-mail-backup convert -h' to convert saved mails to "
+               "text or HTML."
+    )
+    parser.add_argument(
+        "-u", "--user", help="username, otherwise prompt for the value."
+    )
+    parser.add_argument(
+        "-p", "--pass", dest="password", help="password, otherwise prompt for the value."
+    )
+    parser.add_argument(
+        "-d", "--dest", default=".", help="save to dest. Default: %(default)r"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="count", help="print verbose message.", default=0
+    )
+    parser.add_argument(
+        "-f", "--filename-format",
+        default="{index}. [{board}] {title} [{author}] ({time:%Y%m%d%H%M%S}).ans",
+        help="filename format. Default: %(default)r"
+    )
+    range_group = parser.add_mutually_exclusive_group()
+    range_group.add_argument(
+        "-r", "--range", nargs=2, type=int, metavar=("START", "END"), action="append",
+        help="specify a range (inclusive). Negative values and zeros are "
+             "allowed, they are treated as (last_index + value) i.e. --range 0 "
+             "0 would download the last mail. This option could be used multiple times."
+    )
+    range_group.add_argument("--all", action="store_true", help="download all")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="skip mails that are already saved in dest. A manifest file is "
+             "stored in dest to track saved mails."
+    )
+    parser.add_argument(
+        "--store", default="files",
+        help="where to save mails. 'files' saves each mail to a file in dest. "
+             "'sqlite:PATH' saves mails to a SQLite database with full-text "
+             "search, see `python -m ptt_mail_backup.store`. 'archive:PATH' "
+             "streams mails into a .zip, .tar, .tar.gz, .tar.bz2, .tar.xz, or "
+             ".tar.zst archive with an index PATH.index.jsonl. Default: %(default)r"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        help="number of SSH sessions used to fetch mails in parallel. "
+             "Default: %(default)r"
+    )
+    parser.add_argument("--host", default="ptt.cc", help="Default: %(default)r")
+    parser.add_argument("--port", type=int, default=22, help="Default: %(default)r")
+    parser.add_argument(
+        "--record",
+        help="log the SSH session to a file. It could be replayed with "
+             "`python -m ptt_mail_backup.fake_server --replay`. If there are "
+             "multiple workers, the session number is appended to the filename."
+    )
+    parser.add_argument(
+        "--scan", metavar="FILE",
+        help="read the mail list in the range and save it to a JSON file, or "
+             "a SQLite database if the extension is .db/.sqlite. Mails are "
+             "not fetched."
+    )
+    parser.add_argument(
+        "--verify", action="store_true",
+        help="read the mail list and compare it with saved mails in dest or "
+             "the store. Report missing, extra, and renumbered mails. Check "
+             "all mails if no range is specified. Exit with 1 if some mails "
+             "are missing."
+    )
+    parser.add_argument(
+        "--fetch-missing", action="store_true",
+        help="with --verify, fetch missing mails."
+    )
+    parser.add_argument("--sender", help="only process mails whose sender matches this regex.")
+    parser.add_argument("--date", help="only process mails whose date (M/DD) matches this regex.")
+    parser.add_argument("--title", help="only process mails whose title matches this regex.")
+    parser.add_argument(
+        "--no-pipeline", action="store_true",
+        help="wait for each screen before sending the next key. Slower but "
+             "may help if the bot hangs."
+    )
+    parser.add_argument(
+        "--retries", type=int, default=5,
+        help="reconnect and resume at most N times per session if the "
+             "connection is lost. Default: %(default)r"
+    )
+    parser.add_argument(
+        "--stats", metavar="FILE",
+        help="save round trips, received bytes and time of each phase to a "
+             "JSON file, or a Prometheus textfile if the extension is .prom."
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="print the time of each phase and the slowest mails at the end."
+    )
+    daemon_group = parser.add_mutually_exclusive_group()
+    daemon_group.add_argument(
+        "--daemon", metavar="SOCKET",
+        help="login, stay in the mail box, and run jobs sent by --connect "
+             "SOCKET. The session is kept alive and re-established if it is "
+             "broken."
+    )
+    daemon_group.add_argument(
+        "--connect", metavar="SOCKET",
+        help="send this command to a daemon started with --daemon SOCKET "
+             "instead of logging in. The daemon's account is used."
+    )
+    daemon_group.add_argument(
+        "--batch", metavar="CONFIG",
+        help="backup the accounts listed in an INI file. Other options are "
+             "used as defaults of all accounts. See ptt_mail_backup.batch."
+    )
+    parser.add_argument("--stop", action="store_true", help="with --connect, stop the daemon.")
+    parser.add_argument(
+        "--max-sessions", type=int, default=4,
+        help="with --batch, the maximum number of SSH sessions at the same "
+             "time, including workers. Default: %(default)r"
+    )
+    parser.add_argument(
+        "--login-interval", type=float, default=3, metavar="SECONDS",
+        help="with --batch, wait between logins to the same host. "
+             "Default: %(default)r"
+    )
+    # a SessionLimiter shared by all accounts in batch mode
+    parser.set_defaults(limiter=None)
+    return parser
+    
+def check_args(parser, args):
+    if args.stop and not args.connect:
+        parser.error("--stop requires --connect")
+    if args.fetch_missing and not args.verify:
+        parser.error("--fetch-missing requires --verify")
+    if args.verify and not args.range:
+        args.all = True
+    if not args.daemon and not args.stop and not args.batch and not args.range and not args.all:
+        parser.error("one of the arguments -r/--range --all is required")
+    if args.store != "files" and not args.store.startswith(("sqlite:", "archive:")):
+        parser.error("unknown store: {}".format(args.store))
+    if args.store.startswith("archive:"):
+        from .archive import get_format # pylint: disable=import-outside-toplevel
+        try:
+            get_format(args.store[len("archive:"):])
+        except Exception as err: # pylint: disable=broad-except
+            parser.error(str(err))
+    
+def run_job(args, bot=None, stats=None):
+    """Run a backup with the parsed arguments. Return the exit code.
+
+    :arg PTTBot bot: A bot in the mail box. If not set, login with a new
+        session.
+    :arg Stats stats: Collect counters to this object. If not set, a new one
+        is created if ``--stats`` or ``--profile`` is used.
+    """
+    dest = pathlib.Path(args.dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    manifest = None
+    if args.store == "files" and (
+            args.incremental or args.verify and (dest / MANIFEST_NAME).exists()):
+        manifest = Manifest(dest)
+    store = open_store(
+        args.store, dest, args.filename_format, manifest=manifest,
+        # don't replace the archive
+        incremental=args.incremental or args.verify
+    )
+    if stats is None and (args.stats or args.profile):
+        stats = Stats()
+    
+    try:
+        if bot:
+            if stats:
+                bot.stats = stats
+            return run_backup(bot, args, dest, store, stats)
+        return backup(args, dest, store, stats)
+    finally:
+        store.close()
+        if stats and args.stats:
+            stats.save(args.stats)
+        if stats and args.profile:
+            print(stats.format_profile())
+            
+class NoSlot:
+    """The session slot outside of batch mode."""
+    def release(self):
+        pass
+        
+def acquire_slot(args, indexes=None):
+    """Wait for a session slot of the batch mode. The slot should be held
+    while the session is connected, and released after.
+
+    :arg queue.Queue indexes: If set, give up and return ``None`` once the
+        queue is empty, e.g. other sessions fetched all mails meanwhile.
+    """
+    if not args.limiter:
+        return NoSlot()
+    while True:
+        slot = args.limiter.acquire(args.host, timeout=SLOT_POLL_INTERVAL)
+        if indexes is not None and indexes.empty():
+            if slot:
+                slot.release()
+            return None
+        if slot:
+            return slot
+    
+@contextmanager
+def login(args, session=0, stats=None):
+    record = args.record
+    if record and session:
+        record = "{}.{}".format(record, session)
+    with ptt_login(
+        args.user, args.password, args.host, args.port, record,
+        pipelining=not args.no_pipeline, stats=stats
+    ) as bot:
+        yield bot
+            
+def prompt_login(args):
+    if not args.user:
+        args.user = input("User: ")
+    if not args.password:
+        args.password = getpass()
+        
+def backup(args, dest, store, stats=None):
+    prompt_login(args)
+    slot = acquire_slot(args)
+    try:
+        with login(args, stats=stats) as bot:
+            print("Login success, try entering your mail box")
+            with bot.enter_mail():
+                return run_backup(bot, args, dest, store, stats, slot)
+    finally:
+        slot.release()
+            
+def run_backup(bot, args, dest, store, stats=None, slot=None):
+    """Backup mails with a bot in the mail box. Return the exit code.
+
+    :arg slot: The session slot of ``bot``. See :func:`run_session`.
+    """
+    last_index = bot.get_last_index()
+    if args.all:
+        args.range = [[1, last_index]]
+        
+    ranges = []
+    for start, end in args.range:
+        if start <= 0:
+            start += last_index
+        if end <= 0:
+            end += last_index
+        ranges.append((start, end))
+        
+    indexes = queue.Queue()
+    if args.scan or args.incremental or args.verify or has_filter(args):
+        # read the mail list first
+        items = []
+        for start, end in ranges:
+            print("Scanning mail list: {}~{}".format(start, end))
+            items.extend(bot.scan_mailbox(start, end))
+        items = filter_items(
+            items, sender=args.sender, date=args.date, title=args.title
+        )
+        if args.scan:
+            save_index(items, args.scan)
+            print("Saved {} items to {}".format(len(items), args.scan))
+            return 0
+        if args.verify:
+            comparison = verify(args, store, items, ranges)
+            print(format_comparison(comparison))
+            if not args.fetch_missing:
+                return 1 if comparison.missing else 0
+            items = comparison.missing
+        for item in items:
+            indexes.put((item.index, item))
+    else:
+        for start, end in ranges:
+            for i in range(start, end + 1):
+                indexes.put((i, None))
+            
+    errors = []
+    partials = {}
+    store = BackgroundStore(store, stats=stats)
+    workers = [
+        threading.Thread(
+            target=run_worker,
+            args=(args, session, dest, store, indexes, partials, stats, errors),
+            daemon=True
+        )
+        for session in range(1, args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        run_session(
+            args, 0, dest, store, indexes, partials, stats, bot=bot, slot=slot
+        )
+    finally:
+        for worker in workers:
+            worker.join()
+        for writer in partials.values():
+            writer.abort()
+        if stats:
+            # mails left in the queue are put back by broken sessions
+            stats.add_result("failed", indexes.qsize())
+        store.join()
+    if errors:
+        raise errors[0]
+    return 0
+    
+def verify(args, store, items, ranges):
+    """Compare mail list items with saved mails. Saved mails outside the
+    ranges may be renumbered mails but are not reported as extra."""
+    saved = store.saved_items()
+    if has_filter(args):
+        saved = filter_items(
+            [s for s in saved if s.date],
+            sender=args.sender, date=args.date, title=args.title
+        )
+    comparison = compare_items(items, saved)
+    if not args.all:
+        comparison = comparison._replace(extra=[
+            s for s in comparison.extra
+            if s.index is not None and any(start <= s.index <= end for start, end in ranges)
+        ])
+    return comparison
+        
+def run_worker(args, session, dest, store, indexes, partials, stats, errors):
+    """Fetch mails from ``indexes`` with a new session."""
+    try:
+        run_session(args, session, dest, store, indexes, partials, stats)
+    except Exception as err: # pylint: disable=broad-except
+        errors.append(err)
+        
+def run_session(args, session, dest, store, indexes, partials, stats=None,
+                bot=None, slot=None):
+    """Fetch mails from ``indexes``. Reconnect and resume if the connection
+    is lost or the bot gets stuck on an unexpected screen.
+
+    :arg PTTBot bot: A bot that is already in the mail box. If not set, login
+        with a new session.
+    :arg slot: The session slot of ``bot``. It is released if the bot is
+        broken, before waiting for a slot of the new session.
+    """
+    retries = 0
+    while True:
+        if not bot and indexes.empty():
+            # don't wait for a session slot for nothing
+            return
+        try:
+            if bot:
+                fetch_mails(bot, dest, store, indexes, partials)
+            else:
+                new_slot = acquire_slot(args, indexes)
+                if not new_slot:
+                    return
+                try:
+                    with login(args, session, stats) as new_bot:
+                        with new_bot.enter_mail():
+                            fetch_mails(new_bot, dest, store, indexes, partials)
+                finally:
+                    new_slot.release()
+            return
+        except LoginError:
+            raise
+        except Exception as err: # pylint: disable=broad-except
+            if bot:
+                # don't leave the mail box with a broken session
+                bot.channel.close()
+                bot = None
+                if slot:
+                    slot.release()
+            if retries >= args.retries:
+                raise
+            delay = min(2 ** retries, 60)
+            retries += 1
+            print("Session {} is broken ({!r}), reconnecting in {}s ({}/{})".format(
+                session, err, delay, retries, args.retries
+            ))
+            time.sleep(delay)
+        
+def has_filter(args):
+    return bool(args.sender or args.date or args.title)
+        
+def fetch_mails(bot, dest, store, indexes, partials):
+    while True:
+        try:
+            index, item = indexes.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            fetch_mail(bot, dest, store, index, item, partials)
+        except:
+            # let other sessions retry
+            indexes.put((index, item))
+            raise
+        
+def fetch_mail(bot, dest, store, index, item, partials):
+    """Fetch and save a mail.
+
+    :arg str dest: Where temporary files are written.
+    :arg store: See :mod:`ptt_mail_backup.store`.
+    :arg MailItem item: The mail list item. Required for incremental backups.
+    :arg dict partials: Interrupted downloads, mapping mail index to
+        :class:`ptt_mail_backup.article.ArticleWriter`. A broken download is
+        stored here and resumed from the last finished page.
+    """
+    if item and store.is_saved(item):
+        return
+    writer = partials.pop(index, None)
+    if writer and not writer.can_resume():
+        writer.abort()
+        writer = None
+    if writer:
+        print("Resuming mail: {} (line {})".format(index, writer.checkpoint))
+    else:
+        print("Fetching mail: {}".format(index))
+        writer = ArticleWriter(dest)
+    with bot.track_mail(index):
+        try:
+            article = bot.get_article(index, sink=writer, start_line=writer.checkpoint)
+        except Exception:
+            partials[index] = writer
+            raise
+        except BaseException:
+            writer.abort()
+            raise
+        store.save(writer, article, index, item)
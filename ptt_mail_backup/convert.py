@@ -0,0 +1,297 @@
+"""Convert saved mails to UTF-8 plain text and colored HTML.
+
+Mails are saved as Big5-UAO text with ANSI escape sequences. ``convert``
+decodes them with the same color model as :mod:`ptt_mail_backup.ansi`, so a
+double-byte character colored in two halves gets the color of its first
+byte, like in the mail box.
+
+Usage::
+
+    ptt-mail-backup convert backup -o converted
+    ptt-mail-backup convert --format html mail.ans
+
+Directories are searched for ``*.ans`` recursively. Files are converted in a
+process pool. Outputs that are newer than their source are skipped, so
+running it again only converts new mails.
+"""
+import argparse
+import html
+import os
+import pathlib
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .ansi import DEFAULT_COLOR, char_to_color
+from .pyte.graphics import FG_ANSI, BG_ANSI
+
+FORMATS = ("txt", "html")
+
+Attributes = namedtuple("Attributes", ["bold", "blink", "reverse", "fg", "bg"])
+
+DEFAULT_ATTRIBUTES = Attributes(False, False, False, "default", "default")
+
+SGR_FLAGS = {
+    1: ("bold", True),
+    5: ("blink", True),
+    7: ("reverse", True),
+    22: ("bold", False),
+    25: ("blink", False),
+    27: ("reverse", False),
+}
+
+ESCAPE_RX = re.compile(rb"\x1b\[([\d;]*)([@-~])|\x1b")
+
+# match a string of big5 characters. The group is a lead byte without the
+# second byte.
+TAIL_RX = re.compile(rb"(?:[\x81-\xfe][\s\S]|[\x00-\x80\xff])*([\x81-\xfe])?\Z")
+
+COLOR_NAMES = ["black", "red", "green", "brown", "blue", "magenta", "cyan", "white"]
+
+STYLE = """
+body { background: #000; }
+.ansi { color: #aaa; background: #000; font-family: monospace; }
+.f0 { color: #000; } .f1 { color: #a00; } .f2 { color: #0a0; } .f3 { color: #a50; }
+.f4 { color: #00a; } .f5 { color: #a0a; } .f6 { color: #0aa; } .f7 { color: #aaa; }
+.hl { color: #fff; }
+.hl.f0 { color: #555; } .hl.f1 { color: #f55; } .hl.f2 { color: #5f5; } .hl.f3 { color: #ff5; }
+.hl.f4 { color: #55f; } .hl.f5 { color: #f5f; } .hl.f6 { color: #5ff; } .hl.f7 { color: #fff; }
+.b0 { background: #000; } .b1 { background: #a00; } .b2 { background: #0a0; } .b3 { background: #a50; }
+.b4 { background: #00a; } .b5 { background: #a0a; } .b6 { background: #0aa; } .b7 { background: #aaa; }
+.blink { animation: blink 1s step-end infinite; }
+@keyframes blink { 50% { visibility: hidden; } }
+"""
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>{style}</style>
+</head>
+<body>
+<pre class="ansi">{body}</pre>
+</body>
+</html>
+"""
+
+def apply_sgr(attrs, params):
+    """Apply the parameters of an SGR sequence e.g. ``b"1;31"`` to
+    :class:`Attributes`. Unknown codes are ignored."""
+    for param in params.split(b";"):
+        code = int(param or 0)
+        if code == 0:
+            attrs = DEFAULT_ATTRIBUTES
+        elif code in SGR_FLAGS:
+            name, value = SGR_FLAGS[code]
+            attrs = attrs._replace(**{name: value})
+        elif code in FG_ANSI:
+            attrs = attrs._replace(fg=FG_ANSI[code])
+        elif code in BG_ANSI:
+            attrs = attrs._replace(bg=BG_ANSI[code])
+    return attrs
+
+def iter_runs(data):
+    """Split ANSI text into ``(color, bytes)`` runs. ``color`` is a
+    :class:`ptt_mail_backup.ansi.ColorState`. Escape sequences other than
+    SGR are dropped."""
+    attrs = DEFAULT_ATTRIBUTES
+    pos = 0
+    for match in ESCAPE_RX.finditer(data):
+        if match.start() > pos:
+            yield char_to_color(attrs), data[pos:match.start()]
+        if match.group(2) == b"m":
+            attrs = apply_sgr(attrs, match.group(1))
+        pos = match.end()
+    if pos < len(data):
+        yield char_to_color(attrs), data[pos:]
+
+def decode_runs(runs):
+    """Decode ``(color, bytes)`` runs into a list of ``(color, str)``.
+    Adjacent runs of the same color are merged."""
+    runs = list(runs)
+    result = []
+    carry = 0
+    for i, (color, data) in enumerate(runs):
+        # the first byte is used by the previous run
+        data = data[carry:]
+        carry = 0
+        if (i + 1 < len(runs) and TAIL_RX.match(data).group(1) and
+                runs[i + 1][1][0] >= 0x40):
+            data += runs[i + 1][1][:1]
+            carry = 1
+        if not data:
+            continue
+        text = data.decode("big5-uao", "replace").replace("\r", "")
+        if result and result[-1][0] == color:
+            result[-1] = (color, result[-1][1] + text)
+        else:
+            result.append((color, text))
+    return result
+
+def color_class(color):
+    """Return CSS classes of a color, or an empty string for the default
+    color."""
+    classes = []
+    if color.bold:
+        classes.append("hl")
+    if color.fg != DEFAULT_COLOR.fg:
+        classes.append("f{}".format(COLOR_NAMES.index(color.fg)))
+    if color.bg != DEFAULT_COLOR.bg:
+        classes.append("b{}".format(COLOR_NAMES.index(color.bg)))
+    if color.blink:
+        classes.append("blink")
+    return " ".join(classes)
+
+def render_text(runs):
+    return "".join(text for _color, text in runs)
+
+def render_html(runs, title=""):
+    body = []
+    for color, text in runs:
+        text = html.escape(text, quote=False)
+        classes = color_class(color)
+        if classes:
+            body.append('<span class="{}">{}</span>'.format(classes, text))
+        else:
+            body.append(text)
+    return HTML_TEMPLATE.format(
+        title=html.escape(title), style=STYLE, body="".join(body)
+    )
+
+RENDERERS = {
+    "txt": lambda runs, _title: render_text(runs),
+    "html": render_html,
+}
+
+Job = namedtuple("Job", ["source", "targets"])
+
+def convert_file(job):
+    """Convert a file. Run in a worker process.
+
+    :arg Job job: ``targets`` maps a format to the output path.
+    :return: ``(source, error)``. ``error`` is ``None`` on success.
+    """
+    try:
+        runs = decode_runs(iter_runs(pathlib.Path(job.source).read_bytes()))
+        for fmt, target in job.targets.items():
+            target = pathlib.Path(target)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # a broken output must not look newer than the source
+            temp = target.with_name(target.name + ".tmp")
+            temp.write_text(
+                RENDERERS[fmt](runs, pathlib.Path(job.source).stem),
+                encoding="utf-8", newline="\n"
+            )
+            os.replace(temp, target)
+    except Exception as err: # pylint: disable=broad-except
+        return job.source, repr(err)
+    return job.source, None
+
+def is_up_to_date(source, targets):
+    try:
+        mtime = source.stat().st_mtime_ns
+        return all(target.stat().st_mtime_ns >= mtime for target in targets)
+    except FileNotFoundError:
+        return False
+
+def find_sources(paths):
+    """Yield ``(source, relative_path)``. Directories are searched for
+    ``*.ans`` recursively."""
+    for path in map(pathlib.Path, paths):
+        if path.is_dir():
+            for source in sorted(path.rglob("*.ans")):
+                yield source, source.relative_to(path)
+        else:
+            yield path, pathlib.Path(path.name)
+
+def find_jobs(paths, out=None, formats=FORMATS, force=False):
+    """Return ``(jobs, skipped)``. ``jobs`` is a list of :class:`Job`.
+
+    :arg str out: The output directory. If not set, outputs are written next
+        to the sources.
+    """
+    jobs = []
+    skipped = 0
+    for source, relative in find_sources(paths):
+        base = pathlib.Path(out) / relative if out else source
+        if base.suffix == ".ans":
+            base = base.with_suffix("")
+        targets = {fmt: base.with_name(base.name + "." + fmt) for fmt in formats}
+        if not force and is_up_to_date(source, targets.values()):
+            skipped += 1
+            continue
+        jobs.append(Job(str(source), {k: str(v) for k, v in targets.items()}))
+    return jobs, skipped
+
+def get_chunk_size(count, workers):
+    # about 4 chunks per worker to balance uneven mails
+    return max(1, min(64, count // (workers * 4)))
+
+def convert(jobs, workers=None, chunk_size=None):
+    """Convert files in a process pool. Yield ``(source, error)`` in the
+    order of ``jobs``.
+
+    :arg int workers: The number of processes. Default to the CPU count. If
+        it is 1, files are converted in this process.
+    :arg int chunk_size: The number of files sent to a process at once.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < 2:
+        yield from map(convert_file, jobs)
+        return
+    chunk_size = chunk_size or get_chunk_size(len(jobs), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(convert_file, jobs, chunksize=chunk_size)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="ptt-mail-backup convert",
+        description="Convert saved mails to UTF-8 plain text and HTML."
+    )
+    parser.add_argument(
+        "path", nargs="+",
+        help="a file, or a directory which is searched for *.ans recursively."
+    )
+    parser.add_argument(
+        "-o", "--out",
+        help="output directory. The directory structure is kept. Default: "
+             "next to the source."
+    )
+    parser.add_argument(
+        "--format", action="append", choices=FORMATS,
+        help="output format. This option could be used multiple times. "
+             "Default: {}".format(" and ".join(FORMATS))
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int,
+        help="number of processes. Default: the number of CPUs."
+    )
+    parser.add_argument(
+        "--chunk-size", type=int,
+        help="number of files sent to a process at once. Default: based on "
+             "the number of files."
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="convert files even if the outputs are newer than the source."
+    )
+    return parser
+
+def main(argv=None):
+    """Run the ``convert`` subcommand. Return the exit code."""
+    args = build_parser().parse_args(argv)
+    jobs, skipped = find_jobs(args.path, args.out, args.format or FORMATS, args.force)
+    failed = 0
+    for source, error in convert(jobs, args.jobs, args.chunk_size):
+        if error:
+            failed += 1
+            print("Failed to convert {}: {}".format(source, error))
+    print("Converted {} files, skipped {} up-to-date files, {} failed".format(
+        len(jobs) - failed, skipped, failed
+    ))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Keep a logged-in session and run jobs sent over a Unix socket.
+
+Start the daemon::
+
+    ptt-mail-backup -u user -p password --daemon /tmp/ptt.sock
+
+Then run backups without logging in::
+
+    ptt-mail-backup --connect /tmp/ptt.sock -d backup --all --incremental
+
+Stop it with ``ptt-mail-backup --connect /tmp/ptt.sock --stop``.
+
+A job is a JSON line ``{"argv": [...], "cwd": "..."}``, or ``{"stop": true}``.
+The daemon replies with JSON lines ``{"out": "..."}`` and finishes with
+``{"exit": code}``. An invalid request gets ``{"exit": 2}``. Jobs run one at
+a time. While idle, the daemon touches the mail list every :data:`KEEPALIVE`
+seconds so PTT doesn't log it out.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from contextlib import ExitStack, redirect_stdout, redirect_stderr
+
+from .cli import build_parser, check_args, login, run_job
+
+log = logging.getLogger(__name__)
+
+KEEPALIVE = 180
+
+SSH_KEEPALIVE = 30
+
+class ClientWriter:
+    """A file-like object sending text to the client."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return 0
+        with self.lock:
+            try:
+                self.conn.sendall(encode({"out": text}))
+            except OSError:
+                # the client is gone. Keep running the job
+                pass
+        return len(text)
+
+    def flush(self):
+        pass
+
+def encode(message):
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+class Daemon:
+    """Serve jobs with a bot in the mail box.
+
+    :arg args: Parsed arguments. ``daemon`` is the socket path. ``user``,
+        ``password``, ``host``, and ``port`` are used by all jobs.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.path = args.daemon
+        self.bot = None
+        self.stack = None
+        self.running = False
+
+    def connect(self):
+        self.disconnect()
+        stack = ExitStack()
+        try:
+            bot = stack.enter_context(login(self.args))
+            stack.enter_context(bot.enter_mail())
+        except:
+            stack.close()
+            raise
+        bot.channel.get_transport().set_keepalive(SSH_KEEPALIVE)
+        self.stack = stack
+        self.bot = bot
+        log.info("session is ready")
+
+    def disconnect(self):
+        if not self.stack:
+            return
+        try:
+            self.stack.close()
+        except Exception: # pylint: disable=broad-except
+            log.exception("failed to close the session")
+        self.stack = None
+        self.bot = None
+
+    def ensure_session(self):
+        """Connect if there is no session or the session is broken."""
+        if not self.bot or self.bot.channel.closed:
+            self.connect()
+
+    def keepalive(self):
+        try:
+            self.ensure_session()
+            self.bot.get_last_index()
+        except Exception: # pylint: disable=broad-except
+            log.exception("keepalive failed, reconnect later")
+            self.disconnect()
+
+    def serve_forever(self):
+        self.connect()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.path)
+            os.chmod(self.path, 0o600)
+            server.listen()
+            server.settimeout(KEEPALIVE)
+            print("Listening on {}".format(self.path))
+            self.running = True
+            try:
+                while self.running:
+                    try:
+                        conn, _address = server.accept()
+                    except socket.timeout:
+                        self.keepalive()
+                        continue
+                    with conn:
+                        conn.settimeout(None)
+                        try:
+                            self.handle(conn)
+                        except OSError:
+                            # the client is gone
+                            log.exception("connection failed")
+            finally:
+                os.remove(self.path)
+                self.disconnect()
+
+    def handle(self, conn):
+        with conn.makefile("r", encoding="utf-8") as f:
+            request = parse_request(f)
+        if not request:
+            log.warning("invalid request")
+            conn.sendall(encode({"exit": 2}))
+            return
+        if request.get("stop"):
+            self.running = False
+            conn.sendall(encode({"exit": 0}))
+            return
+        writer = ClientWriter(conn)
+        code = 0
+        cwd = os.getcwd()
+        with redirect_stdout(writer), redirect_stderr(writer):
+            try:
+                os.chdir(request["cwd"])
+                code = self.run(request["argv"])
+            except SystemExit as err:
+                # argparse
+                code = err.code
+            except Exception as err: # pylint: disable=broad-except
+                log.exception("job failed")
+                print("Error: {!r}".format(err))
+                code = 1
+                # the bot may be left in an unknown screen
+                self.disconnect()
+            finally:
+                os.chdir(cwd)
+        try:
+            conn.sendall(encode({"exit": code}))
+        except OSError:
+            pass
+
+    def run(self, argv):
+        parser = build_parser()
+        args = parser.parse_args(argv)
+        if args.daemon or args.connect or args.batch:
+            parser.error("--daemon, --connect, and --batch can't be used in a job")
+        check_args(parser, args)
+        for name in ("user", "password", "host", "port", "no_pipeline"):
+            setattr(args, name, getattr(self.args, name))
+        self.ensure_session()
+        return run_job(args, bot=self.bot)
+
+def parse_request(f):
+    """Read a request line. Return ``None`` if it is empty or invalid."""
+    try:
+        request = json.loads(f.readline())
+    except ValueError:
+        return None
+    if not isinstance(request, dict):
+        return None
+    if request.get("stop"):
+        return request
+    if isinstance(request.get("argv"), list) and isinstance(request.get("cwd"), str):
+        return request
+    return None
+
+def strip_connect(argv):
+    """Remove ``--connect`` and ``--stop`` from the command line."""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--connect":
+            skip = True
+        elif not arg.startswith("--connect=") and arg != "--stop":
+            result.append(arg)
+    return result
+
+def send_job(path, argv, stop=False, out=None):
+    """Send a job to the daemon and print the output. Return the exit code.
+
+    :arg list argv: The command line. ``--connect`` is removed.
+    :arg bool stop: Stop the daemon instead.
+    :arg out: Where to print the output. Default to ``sys.stdout``.
+    """
+    if out is None:
+        out = sys.stdout
+    if stop:
+        request = {"stop": True}
+    else:
+        request = {"argv": strip_connect(argv), "cwd": os.getcwd()}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(path)
+        conn.sendall(encode(request))
+        with conn.makefile("r", encoding="utf-8") as f:
+            for line in f:
+                message = json.loads(line)
+                if "exit" in message:
+                    return message["exit"]
+                out.write(message["out"])
+                out.flush()
+    print("Error: the daemon closed the connection", file=out)
+    return 1
@@ -0,0 +1,568 @@
+"""A local stand-in of ptt.cc for offline testing and benchmarking.
+
+:class:`FakePTT` simulates the screens used by :class:`ptt_mail_backup.ptt_bot.PTTBot`
+(login, main menu, mail list, pmore pager, help screens, etc.).
+:class:`ReplayPTT` replays a session recorded by
+:class:`ptt_mail_backup.recorder.RecordingChannel`.
+
+Run ``python -m ptt_mail_backup.fake_server`` then connect with
+``ptt-mail-backup --host localhost --port 2222 ...``.
+"""
+import argparse
+import logging
+import re
+import socket
+import threading
+import time
+from collections import namedtuple
+
+import paramiko
+
+from .recorder import load_record
+
+log = logging.getLogger(__name__)
+
+LINES = 24
+COLUMNS = 80
+PAGE_LINES = LINES - 1
+LIST_TOP = 3
+LIST_ROWS = 20
+
+RX_SGR = re.compile(rb"\x1b\[[\d;]*m")
+
+Mail = namedtuple("Mail", ["date", "sender", "title", "lines", "animated"])
+
+def big5(text):
+    return text.encode("big5-uao")
+
+def make_mail(date, sender, title, body, nick="", time_str="Sun Jun 10 12:00:00 2018",
+              animated=False):
+    """Create a :class:`Mail`. The header is rendered like pmore.
+
+    :arg list body: A list of str or bytes. Bytes are sent as-is so they could
+        contain ANSI escape sequences.
+    """
+    header = [
+        "\x1b[34;47m 作者 \x1b[44;37m {} ({}) \x1b[m".format(sender, nick),
+        "\x1b[34;47m 標題 \x1b[44;37m {} \x1b[m".format(title),
+        "\x1b[34;47m 時間 \x1b[44;37m {} \x1b[m".format(time_str),
+        "\x1b[36m" + "─" * 39 + "\x1b[m",
+    ]
+    lines = [big5(l) if isinstance(l, str) else l for l in header + body]
+    return Mail(date, sender, title, lines, animated)
+
+def sample_mails(count=20):
+    """Generate mails containing short, long, wide and colored articles."""
+    mails = []
+    for i in range(1, count + 1):
+        kind = i % 4
+        if kind == 0:
+            body = ["第 {} 行".format(n) for n in range(200)]
+        elif kind == 1:
+            body = [
+                "寬" * 60 + "{:04d}".format(n) + "x" * (n * 7 % 120)
+                for n in range(30)
+            ]
+        elif kind == 2:
+            body = [
+                b"\x1b[1;33;41m" + big5("彩色") + b"\x1b[5;32m" + big5("閃爍") +
+                b"\x1b[m " + big5("一般文字 {}".format(n))
+                for n in range(40)
+            ]
+        else:
+            body = ["短信", "", "謝謝"]
+        mails.append(make_mail(
+            "{}/{:02d}".format(i % 12 + 1, i % 28 + 1),
+            "user{}".format(i),
+            "測試信件 {}".format(i) + " 很長的標題" * (i % 3),
+            body,
+            animated=i == 3
+        ))
+    return mails
+
+def to_cells(line):
+    """Split a line into a list of ``(sgr, byte, is_lead)``."""
+    cells = []
+    sgr = b""
+    pos = 0
+    lead = False
+    while pos < len(line):
+        match = RX_SGR.match(line, pos)
+        if match:
+            code = match.group()
+            sgr = b"" if code in (b"\x1b[m", b"\x1b[0m") else sgr + code
+            pos = match.end()
+            continue
+        byte = line[pos:pos + 1]
+        is_lead = not lead and byte[0] >= 0x81
+        lead = is_lead
+        cells.append((sgr, byte, is_lead))
+        pos += 1
+    return cells
+
+def render_cells(cells):
+    out = []
+    sgr = b""
+    for cell_sgr, byte in cells:
+        if cell_sgr != sgr:
+            out.append(b"\x1b[m" + cell_sgr)
+            sgr = cell_sgr
+        out.append(byte)
+    if sgr:
+        out.append(b"\x1b[m")
+    return b"".join(out)
+
+TRUNCATED_RIGHT = b"\x1b[m\x1b[1m>\x1b[m "
+TRUNCATED_LEFT = b"\x1b[m\x1b[1m<\x1b[m"
+
+def render_pager_line(cells, shift):
+    """Render a line with horizontal shift ``shift`` (in columns) like pmore.
+    """
+    if shift:
+        start = shift
+        width = COLUMNS - 1
+        prefix = TRUNCATED_LEFT
+        if start >= len(cells):
+            return prefix
+    else:
+        start = 0
+        width = COLUMNS
+        prefix = b""
+    visible = [(sgr, byte) for sgr, byte, _lead in cells[start:]]
+    if shift and start < len(cells) and not cells[start][2] and start and cells[start - 1][2]:
+        # the first char is a trail byte
+        visible[0] = (visible[0][0], b"?")
+    if len(visible) <= width:
+        return prefix + render_cells(visible)
+    visible = visible[:width - 2]
+    if cells[start + width - 3][2]:
+        # the last char is a lead byte
+        visible[-1] = (visible[-1][0], b"?")
+    return prefix + render_cells(visible) + TRUNCATED_RIGHT
+
+class FakePTT:
+    """Simulate a PTT session. Call :meth:`connect` to get the first screen,
+    then :meth:`feed` client input to get the response.
+
+    :arg list mails: A list of :class:`Mail`.
+    :arg str password: Reject other passwords if set.
+    :arg bool duplicate_login: Ask whether to delete other sessions after
+        login.
+    :arg bool login_view: Show a login view after login.
+    """
+    def __init__(self, mails=None, password=None, duplicate_login=False,
+                 login_view=False):
+        self.mails = sample_mails() if mails is None else mails
+        self.password = password
+        self.duplicate_login = duplicate_login
+        self.login_view = login_view
+        self.mode = "user"
+        self.buffer = b""
+        self.cursor = len(self.mails)
+        self.mail = None
+        self.top = 0
+        self.shift = 0
+        self.user = None
+        self.last_screen = b""
+
+    def connect(self):
+        return self.screen(["請輸入代號，或以 guest 參觀，或以 new 註冊: "])
+
+    def screen(self, lines, footer=None):
+        out = [b"\x1b[H\x1b[2J"]
+        for row, line in enumerate(lines[:LINES]):
+            if isinstance(line, str):
+                line = big5(line)
+            out.append("\x1b[{};1H".format(row + 1).encode("latin-1") + line)
+        if footer is not None:
+            if isinstance(footer, str):
+                footer = big5(footer)
+            out.append("\x1b[{};1H".format(LINES).encode("latin-1") + footer)
+        self.last_screen = b"".join(out)
+        return self.last_screen
+
+    def feed(self, data):
+        out = []
+        for i in range(len(data)):
+            key = data[i:i + 1]
+            if key == b"\x0c":
+                result = self.redraw()
+            else:
+                # handlers return None if the screen is not changed
+                result = getattr(self, "on_" + self.mode)(key) # pylint: disable=assignment-from-none
+            if result:
+                out.append(result)
+        return b"".join(out)
+
+    def redraw(self):
+        """Handle ``Ctrl-L``."""
+        if self.mode == "pager":
+            # the pager may be moved without redrawing
+            return self.pager()
+        return self.last_screen
+
+    def read_line(self, key):
+        """Collect input until ``\\r``. Return the line or ``None``."""
+        if key == b"\r":
+            line, self.buffer = self.buffer, b""
+            return line.decode("latin-1")
+        self.buffer += key
+        return None
+
+    def on_user(self, key):
+        user = self.read_line(key)
+        if user is None:
+            return None
+        self.user = user
+        self.mode = "password"
+        return None
+
+    def on_password(self, key):
+        password = self.read_line(key)
+        if password is None:
+            return None
+        if self.password is not None and password != self.password:
+            self.mode = "user"
+            return self.screen(["密碼不對喔！", "請輸入代號: "])
+        if self.duplicate_login:
+            self.mode = "duplicate"
+            return self.screen(["您想刪除其他重複登入的連線嗎？[Y/n] "])
+        return self.press_any_key()
+
+    def on_duplicate(self, key):
+        if self.read_line(key) is None:
+            return None
+        return self.press_any_key()
+
+    def press_any_key(self):
+        self.mode = "press_any"
+        return self.screen(["歡迎您再度拜訪"], footer="請按任意鍵繼續")
+
+    def on_press_any(self, _key):
+        if self.login_view:
+            self.mode = "view"
+            return self.screen(["本日十大熱門話題"], footer="(←/q)")
+        return self.main_menu()
+
+    def on_view(self, _key):
+        return self.main_menu()
+
+    def main_menu(self):
+        self.mode = "main"
+        return self.screen(["【主功能表】                       批踢踢實業坊"])
+
+    def on_main(self, key):
+        if key == b"\x1a":
+            self.mode = "main_ctrl_z"
+
+    def on_main_ctrl_z(self, key):
+        if key == b"m":
+            return self.mail_list()
+        self.mode = "main"
+        return None
+
+    def mail_list(self, prompt=None, mode="mail"):
+        self.mode = mode
+        lines = [
+            "【郵件選單】                     鴻雁往返",
+            "[←]離開 [→]閱讀 [Ctrl-P]發表文章 [d]刪除 [z]精華區 [h]說明",
+            " 編號   日 期 作 者          信  件  標  題",
+        ]
+        start = (max(self.cursor, 1) - 1) // LIST_ROWS * LIST_ROWS + 1
+        for index in range(start, min(start + LIST_ROWS, len(self.mails) + 1)):
+            mail = self.mails[index - 1]
+            lines.append(
+                (b"\xa1\xb4" if index == self.cursor else b"  ") +
+                "{:>4}   {:>5} {:<14} ".format(index, mail.date, mail.sender).encode("latin-1") +
+                big5("◇ " + mail.title)
+            )
+        footer = prompt or "  鴻雁往返  (R/y)回信 (x)站內轉寄 (d/D)刪信 (^P)寄發新信"
+        return self.screen(lines, footer=footer)
+
+    def on_mail(self, key):
+        if key.isdigit():
+            self.buffer = key
+            return self.mail_list(prompt="跳至第幾項：" + key.decode(), mode="jump")
+        if key == b"$":
+            self.cursor = len(self.mails)
+            return self.mail_list()
+        if key == b"h":
+            self.mode = "mail_help"
+            return self.screen(["郵件選單說明"], footer="  呼叫小天使  (q)離開")
+        if key == b"x":
+            self.mode = "forward"
+            self.buffer = b""
+            return self.screen(["", "", "", "把這篇文章轉寄給 [{}]: ".format(self.user)])
+        if key == b"\r":
+            return self.enter_article()
+        if key == b"q":
+            return self.main_menu()
+        return None
+
+    def on_jump(self, key):
+        if key == b"\r":
+            index = int(self.buffer)
+            self.buffer = b""
+            self.cursor = min(max(index, 1), len(self.mails))
+            return self.mail_list()
+        self.buffer += key
+        return self.mail_list(prompt="跳至第幾項：" + self.buffer.decode(), mode="jump")
+
+    def on_mail_help(self, _key):
+        return self.mail_list()
+
+    def on_forward(self, key):
+        self.buffer += key
+        if self.buffer.endswith(b"\r") and self.buffer.count(b"\r") == 1:
+            title = self.mails[self.cursor - 1].title
+            return self.screen([
+                "",
+                "",
+                "標  題: {} (fwd)".format(title),
+                "確定要轉寄嗎? [y/N]"
+            ])
+        if self.buffer.endswith(b"\x18a\r\r"):
+            self.buffer = b""
+            return self.mail_list()
+        return None
+
+    def enter_article(self):
+        self.mail = self.mails[self.cursor - 1]
+        self.top = 0
+        self.shift = 0
+        if self.mail.animated:
+            self.mode = "animation"
+            return self.screen(["這份文件是可播放的文字動畫，要開始播放嗎？ [Y/n]"])
+        return self.pager()
+
+    def on_animation(self, _key):
+        return self.pager()
+
+    def pager(self):
+        self.mode = "pager"
+        total = len(self.mail.lines)
+        bottom = min(self.top + PAGE_LINES, total)
+        lines = [
+            render_pager_line(to_cells(line), self.shift)
+            for line in self.mail.lines[self.top:bottom]
+        ]
+        percent = 100 if bottom >= total else bottom * 100 // total
+        footer = (
+            "\x1b[34;46m 瀏覽 第 {}/{} 頁 ({:>3}%) "
+            "\x1b[1;30;47m 目前顯示: 第 {:02d}~{:02d} 行\x1b[m"
+        ).format(
+            self.top // PAGE_LINES + 1, (total - 1) // PAGE_LINES + 1,
+            percent, self.top + 1, bottom
+        )
+        return self.screen(lines, footer=footer)
+
+    def on_pager(self, key):
+        if key == b"q":
+            self.mail = None
+            return self.mail_list()
+        if key == b"h":
+            self.mode = "pager_help"
+            return self.screen(["pmore 使用說明"], footer="  呼叫小天使  (q)離開")
+        if key == b"o":
+            self.mode = "pmore_conf"
+            lines = [""] * 15 + ["piaip's more: pmore 2007+ 設定選項"]
+            return self.screen(lines)
+        if key == b":":
+            self.mode = "goto"
+            self.buffer = b""
+            return self.screen([], footer="跳至此行: ")
+        if key == b"j":
+            self.goto(self.top + 1)
+        elif key == b">":
+            self.shift += 8
+        elif key == b"<":
+            self.shift = max(self.shift - 8, 0)
+        # pmore doesn't redraw the whole screen after moving. The bot
+        # refreshes the screen with the help screen.
+        return None
+
+    def goto(self, top):
+        self.top = max(min(top, len(self.mail.lines) - PAGE_LINES), 0)
+
+    def on_goto(self, key):
+        line = self.read_line(key)
+        if line is None:
+            return None
+        self.goto(int(line or 1) - 1)
+        return self.pager()
+
+    def on_pager_help(self, _key):
+        return self.pager()
+
+    def on_pmore_conf(self, key):
+        if key == b"q":
+            return self.pager()
+        return None
+
+class ReplayPTT:
+    """Replay a recorded session. Client input is matched with recorded
+    ``send`` events by length, so the client should send the same sequence.
+    """
+    def __init__(self, path):
+        self.events = load_record(path)
+        self.pos = 0
+        self.buffer = b""
+
+    def flush_recv(self):
+        out = []
+        while self.pos < len(self.events) and self.events[self.pos][1] == "recv":
+            out.append(self.events[self.pos][2])
+            self.pos += 1
+        return b"".join(out)
+
+    def connect(self):
+        return self.flush_recv()
+
+    def feed(self, data):
+        self.buffer += data
+        out = []
+        while self.pos < len(self.events):
+            _time, _op, sent = self.events[self.pos]
+            if len(self.buffer) < len(sent):
+                break
+            if self.buffer[:len(sent)] != sent:
+                log.warning("replay input mismatch: %r != %r", self.buffer[:len(sent)], sent)
+            self.buffer = self.buffer[len(sent):]
+            self.pos += 1
+            out.append(self.flush_recv())
+        return b"".join(out)
+
+class ServerInterface(paramiko.ServerInterface):
+    def __init__(self):
+        self.shell_event = threading.Event()
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return "password,none"
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_pty_request(self, *args): # pylint: disable=arguments-differ,unused-argument
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_event.set()
+        return True
+
+class FakeServer:
+    """Serve a session simulator over SSH in a background thread.
+
+    :arg callable create_session: Return a :class:`FakePTT` or
+        :class:`ReplayPTT` for each connection.
+    :arg float latency: Seconds to wait before each response.
+    :arg bool split_keys: Respond to each key separately like PTT, instead of
+        responding to all keys received in a packet at once.
+    """
+    def __init__(self, create_session=FakePTT, host="localhost", port=0, latency=0,
+                 split_keys=False):
+        self.create_session = create_session
+        self.latency = latency
+        self.split_keys = split_keys
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()[:2]
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def serve_forever(self):
+        while not self.closed:
+            try:
+                client, _addr = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client):
+        with paramiko.Transport(client) as transport:
+            transport.add_server_key(self.host_key)
+            server = ServerInterface()
+            transport.start_server(server=server)
+            channel = transport.accept(20)
+            if channel is None:
+                return
+            server.shell_event.wait(10)
+            session = self.create_session()
+            self.respond(channel, session.connect())
+            while True:
+                data = channel.recv(4096)
+                if not data:
+                    return
+                if self.split_keys:
+                    for i in range(len(data)):
+                        self.respond(channel, session.feed(data[i:i + 1]))
+                else:
+                    self.respond(channel, session.feed(data))
+
+    def respond(self, channel, data):
+        if not data:
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        channel.sendall(data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake PTT SSH server.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument(
+        "--latency", type=float, default=0,
+        help="seconds to wait before each response. Default: %(default)r"
+    )
+    parser.add_argument("--mails", type=int, default=20, help="number of sample mails")
+    parser.add_argument("--replay", help="replay a recorded session")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level="INFO")
+
+    if args.replay:
+        def create_session():
+            return ReplayPTT(args.replay)
+    else:
+        mails = sample_mails(args.mails)
+        def create_session():
+            return FakePTT(mails)
+
+    server = FakeServer(create_session, args.host, args.port, args.latency)
+    print("Listening on {}:{}".format(server.host, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Format filenames with ``ptt_article_parser``. The parser is imported on
+the first call since it is slow to import.
+"""
+import string
+from datetime import datetime
+
+class DummyDir:
+    """Provide the mail list info to ``ptt_article_parser``, in place of a
+    ``.DIR`` file."""
+    # method names follow the DIR interface of ptt_article_parser
+    # pylint: disable=invalid-name
+    def __init__(self, article):
+        self.article = article
+        
+    def getAuthor(self, _file):
+        return self.article.sender
+        
+    def getTitle(self, _file):
+        return self.article.title
+        
+    def getTime(self, _file):
+        if getattr(self.article, "time", None):
+            return self.article.time
+        date = datetime.strptime(self.article.date, "%m/%d")
+        date = datetime.today().replace(month=date.month, day=date.day)
+        if date > datetime.today():
+            date = date.replace(year=date.year - 1)
+        return date
+
+def get_fields(filename_format):
+    return {
+        name for _text, name, _spec, _conversion
+        in string.Formatter().parse(filename_format) if name
+    }
+
+def parse_content(content):
+    from ptt_article_parser import Article as ArticleParser # pylint: disable=import-outside-toplevel
+    if callable(content):
+        content = content()
+    return ArticleParser(content)
+
+def get_filename(content, article, index, filename_format):
+    """Format the filename of an article.
+
+    :arg content: Article bytes, or a callable returning them. They are only
+        parsed if ``article`` doesn't have ``author`` from the article header
+        e.g. a :class:`ptt_mail_backup.manifest.Record`, or if a field used by
+        ``filename_format`` is missing in the header.
+    :arg article: An :class:`ptt_mail_backup.article.Article`.
+    """
+    # pylint: disable=import-outside-toplevel
+    from ptt_article_parser.helper import safe_file_name
+    if getattr(article, "author", None):
+        context = {
+            "title": article.title,
+            "author": article.author,
+            "board": article.board,
+            "time": getattr(article, "time", None),
+            "index": index
+        }
+        if any(context[k] is None for k in get_fields(filename_format)
+               if k in ("board", "time")):
+            # the board could be in the URL of the signature or a forward
+            # head, and the time in edit records
+            parsed = parse_content(content)
+            context["board"] = context["board"] or parsed.getBoard()
+            context["time"] = context["time"] or parsed.getTime()
+        if not context["time"]:
+            context["time"] = DummyDir(article).getTime(None)
+        return safe_file_name(filename_format.format_map(context))
+    from ptt_article_parser.rename import format_filename
+    return format_filename(
+        article=parse_content(content),
+        format=filename_format,
+        dir=DummyDir(article),
+        extra={"index": index}
+    )
@@ -0,0 +1,123 @@
+import json
+import re
+import sqlite3
+from collections import namedtuple
+
+from .ptt_bot import MailItem
+
+def is_sqlite(path):
+    return str(path).endswith((".db", ".sqlite", ".sqlite3"))
+
+def save_index(items, path):
+    """Save a list of :class:`MailItem` to a JSON file, or a SQLite database
+    if the extension is ``.db``, ``.sqlite`` or ``.sqlite3``.
+    """
+    if is_sqlite(path):
+        with sqlite3.connect(str(path)) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mail "
+                "(`index` INTEGER PRIMARY KEY, date TEXT, sender TEXT, title TEXT)"
+            )
+            conn.execute("DELETE FROM mail")
+            conn.executemany("INSERT INTO mail VALUES (?, ?, ?, ?)", items)
+        conn.close()
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([item._asdict() for item in items], f, ensure_ascii=False, indent=2)
+
+def load_index(path):
+    if is_sqlite(path):
+        with sqlite3.connect(str(path)) as conn:
+            rows = conn.execute("SELECT * FROM mail ORDER BY `index`").fetchall()
+        conn.close()
+        return [MailItem(*row) for row in rows]
+    with open(path, encoding="utf-8") as f:
+        return [MailItem(**item) for item in json.load(f)]
+
+def filter_items(items, sender=None, date=None, title=None):
+    """Filter mail items with regular expressions."""
+    filters = [
+        (field, re.compile(pattern))
+        for field, pattern in (("sender", sender), ("date", date), ("title", title))
+        if pattern
+    ]
+    return [
+        item for item in items
+        if all(rx.search(getattr(item, field)) for field, rx in filters)
+    ]
+
+Comparison = namedtuple("Comparison", ["saved", "missing", "renumbered", "extra"])
+
+def compare_items(items, saved):
+    """Compare the mail list with saved mails.
+
+    A saved mail with the same index only needs a matching title, since the
+    header of a forwarded mail has the original author and time. Otherwise
+    mails are matched by date, sender, and title, and reported as
+    renumbered. The title of a saved mail may be longer since titles are
+    truncated in the mail list.
+
+    :arg list items: :class:`MailItem` from the mail list.
+    :arg list saved: :class:`MailItem` of saved mails. ``index`` may be
+        ``None`` if it is unknown.
+    :return: A :class:`Comparison`. ``saved`` and ``missing`` are lists of
+        :class:`MailItem`, ``renumbered`` is a list of ``(saved, item)``, and
+        ``extra`` is a list of saved mails that are not in the mail list.
+    """
+    by_index = {}
+    by_key = {}
+    for i, record in enumerate(saved):
+        by_index.setdefault(record.index, []).append((i, record))
+        by_key.setdefault((record.date, record.sender), []).append((i, record))
+    used = set()
+    
+    def find(item, pool):
+        for i, record in pool:
+            if i not in used and record.title.startswith(item.title):
+                used.add(i)
+                return record
+        return None
+        
+    matched = []
+    rest = []
+    for item in items:
+        if find(item, by_index.get(item.index, ())):
+            matched.append(item)
+        else:
+            rest.append(item)
+    missing = []
+    renumbered = []
+    for item in rest:
+        record = find(item, by_key.get((item.date, item.sender), ()))
+        if record:
+            renumbered.append((record, item))
+        else:
+            missing.append(item)
+    extra = [record for i, record in enumerate(saved) if i not in used]
+    return Comparison(matched, missing, renumbered, extra)
+
+def format_comparison(comparison):
+    def format_item(item, index=None):
+        return "{:>10} {:>5} {:<13} {}".format(
+            index or item.index or "-", item.date or "-", item.sender or "-", item.title
+        )
+    lines = []
+    for name, rows in [
+        ("Missing", [format_item(item) for item in comparison.missing]),
+        ("Renumbered", [
+            format_item(item, "{} -> {}".format(record.index or "-", item.index))
+            for record, item in comparison.renumbered
+        ]),
+        ("Extra", [format_item(record) for record in comparison.extra]),
+    ]:
+        if rows:
+            lines.append("{} ({}):".format(name, len(rows)))
+            lines.extend(rows)
+    lines.append(
+        "Verified {} mails: {} saved, {} missing, {} renumbered, {} extra".format(
+            len(comparison.saved) + len(comparison.missing) + len(comparison.renumbered),
+            len(comparison.saved), len(comparison.missing),
+            len(comparison.renumbered), len(comparison.extra)
+        )
+    )
+    return "\n".join(lines)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import pathlib
+import threading
+from collections import namedtuple
+
+MANIFEST_NAME = ".ptt-mail-backup.json"
+
+Record = namedtuple("Record", [
+    "index", "date", "sender", "title", "full_title", "hash", "filename"
+])
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+def record_key(record):
+    return record.date, record.sender, record.title
+
+class Manifest:
+    """A list of saved mails stored in the destination folder.
+
+    Records are keyed by mail index. Since PTT renumbers the mailbox when
+    older mails are deleted, a record can be moved to a new index if a mail
+    with the same date, sender, and title is found there.
+    """
+    def __init__(self, dest):
+        self.dest = pathlib.Path(dest)
+        self.path = self.dest / MANIFEST_NAME
+        self.records = {}
+        self.shift = 0
+        self.lock = threading.RLock()
+        if self.path.exists():
+            self.load()
+
+    def load(self):
+        data = json.loads(self.path.read_text("utf-8"))
+        for mail in data["mails"]:
+            record = Record(**mail)
+            self.records[record.index] = record
+
+    def save(self):
+        with self.lock:
+            data = {
+                "version": 1,
+                "mails": [r._asdict() for _i, r in sorted(self.records.items())]
+            }
+        temp = self.path.with_name(self.path.name + ".tmp")
+        temp.write_text(json.dumps(data, ensure_ascii=False, indent=2), "utf-8")
+        os.replace(temp, self.path)
+
+    def match(self, item):
+        """Find the record of a mail list item. Return ``None`` if the mail is
+        not archived.
+
+        :arg item: A ``(index, date, sender, title)`` tuple returned by
+            :func:`ptt_mail_backup.ptt_bot.parse_board_item`.
+        """
+        index, *key = item
+        key = tuple(key)
+        record = self.records.get(index)
+        if record and record_key(record) == key and self.exists(record):
+            return record
+
+        candidates = [
+            r for r in self.records.values()
+            if r.index != index and record_key(r) == key and self.exists(r)
+        ]
+        if not candidates:
+            return None
+        # indexes only shift down when older mails are deleted. Prefer the
+        # record matching the previous shift.
+        record = min(
+            candidates,
+            key=lambda r: (r.index != index + self.shift, r.index < index, r.index)
+        )
+        self.shift = record.index - index
+        return record
+
+    def exists(self, record):
+        return self.dest.joinpath(record.filename).exists()
+
+    def add(self, item, article, sha1, filename):
+        """Add a record.
+
+        :arg item: The mail list item. The title in the mail list may be
+            truncated, which is different from ``article.title``.
+        """
+        index, date, sender, title = item
+        self.records[index] = Record(
+            index, date, sender, title, article.title, sha1, filename
+        )
+
+    def move(self, record, index, filename):
+        """Move a record to a new index and rename its file."""
+        if self.records.get(record.index) is record:
+            del self.records[record.index]
+        if filename != record.filename:
+            os.replace(self.dest / record.filename, self.dest / filename)
+        record = record._replace(index=index, filename=filename)
+        self.records[index] = record
+        return record
@@ -1,24 +1,78 @@
+import functools
 import logging
 import math
 import re
+import socket
+import time
+from collections import namedtuple
 from contextlib import contextmanager
+from datetime import datetime
 from getpass import getpass
 
-import uao
-from paramiko.client import SSHClient, AutoAddPolicy
-
 from .pyte import ByteScreen, ByteStream
 from .article import Article
-
-uao.register_uao()
+from .recorder import RecordingChannel
+from .stats import Counter, Stats
+from .waiting import RTTEstimator, Wait
 
 log = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=None)
+def big5(text):
+    """Encode a screen marker. Markers are matched against every packet, so
+    each one is only encoded once."""
+    return text.encode("big5-uao")
+
+def compile_markers(markers):
+    """Encode a dict of markers into a table for :func:`find_markers`.
+
+    A marker is a str, a list of alternatives, or a ``(str, regex)`` tuple.
+    The regex is a bytes pattern and is only searched if the str is found.
+    Substring tests are much faster than a regex alternation since most
+    packets don't contain any marker.
+    """
+    table = []
+    for name, marker in markers.items():
+        rx = None
+        if isinstance(marker, tuple):
+            marker, rx = marker
+            rx = re.compile(rx)
+        if isinstance(marker, str):
+            marker = [marker]
+        table.append((name, tuple(big5(m) for m in marker), rx))
+    return table
+
+def find_markers(table, data):
+    """Return the set of marker names found in ``data``."""
+    found = set()
+    for name, needles, rx in table:
+        for needle in needles:
+            if needle in data:
+                if not rx or rx.search(data):
+                    found.add(name)
+                break
+    return found
+
 RX_LAST_PAGE = re.compile(r"瀏覽.+?\(100%\)".encode("big5-uao"))
 
 # FIXME: only work with old cursor
 RX_HIGHLIGHT_LINE = re.compile(r"\s*●\s*\d+".encode("big5-uao"))
 
+RX_ESCAPE = re.compile(rb"\x1b\[[\d;]*[a-zA-Z]")
+
+TAIL_SIZE = 64
+
+# redraw the screen
+REFRESH_KEY = b"\x0c"
+
+RX_BOARD_ITEM = re.compile(r"(?:\s|●)*\d+\s".encode("big5-uao"))
+
+RX_HEADER = re.compile(r"\s*(作者|標題|時間)\s+(.*?)\s*$")
+
+RX_HEADER_BOARD = re.compile(r"(.*?)\s+看板\s+(\S+)$")
+
+HEADER_TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
 LOGIN_VIEWS = [
     "本週五十大熱門話題",
     "本日十大熱門話題",
@@ -29,6 +83,40 @@ LOGIN_VIEWS = [
     "(←/q)"
 ]
 
+LOGIN_MARKERS = compile_markers({
+    "duplicate": "刪除其他重複登入",
+    "wrong_password": "密碼不對喔！",
+})
+
+AFTER_LOGIN_MARKERS = compile_markers({
+    "recover": "編輯器自動復原",
+    "login_attempts": "您要刪除以上錯誤嘗試的記錄嗎?",
+    "mailbox_full": (
+        "超出上限",
+        re.escape(big5("您保存信件數目 ")) + rb"\d+" + re.escape(big5(" 超出上限 ")) + rb"\d+"
+    ),
+    "new_board": "新看板，確定要加入我的最愛嗎",
+    "view": LOGIN_VIEWS,
+})
+
+class LoginError(Exception):
+    """Failed to login. Retrying won't help."""
+
+MailItem = namedtuple("MailItem", ["index", "date", "sender", "title"])
+
+ArticleHeader = namedtuple("ArticleHeader", ["sender", "title", "time", "author", "board"])
+
+def in_phase(name):
+    """Decorate a generator method of :class:`BaseBot` to run in a phase. See
+    :meth:`BaseBot.phase`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(self, *args, **kwargs):
+            with self.phase(name):
+                return (yield from func(self, *args, **kwargs))
+        return wrapped
+    return decorator
+
 def is_no(text):
     return bool(re.match(r"\s*(n|no)\s*", text, re.I))
     
@@ -44,135 +132,430 @@ def parse_board_item(line):
         title = title[2:]
     elif title.startswith("R:"):
         title = "Re:" + title[2:]
-    return no, date, sender, title
+    return MailItem(no, date, sender, title)
+    
+def plan_columns(screen, complete, candidates=None):
+    """Return line numbers which need another horizontal pass.
+
+    :arg ArticleScreen screen: The last screen.
+    :arg int complete: Lines before this are already drawn in full width e.g.
+        the last page overlapping the previous one.
+    :arg set candidates: Lines that were truncated in the previous pass. A line
+        that is not truncated can't be truncated further right.
+    """
+    return {
+        line.line_no for line in screen.lines
+        if line.right_truncated and line.line_no >= complete and
+        (candidates is None or line.line_no in candidates)
+    }
+    
+def parse_header(lines, columns=80):
+    """Parse the article header drawn by pmore on the first page.
+
+    :arg list lines: The first 3 screen lines as bytes.
+    :return: An :class:`ArticleHeader`, or ``None`` if the header is missing
+        or the title may be truncated by the screen width.
+    """
+    fields = {}
+    for line in lines[:3]:
+        match = RX_HEADER.match(line.decode("big5-uao", "replace"))
+        if not match:
+            return None
+        fields[match.group(1)] = match.group(2)
+    if len(lines[1].rstrip()) >= columns - 2:
+        return None
+    try:
+        post_time = datetime.strptime(fields["時間"], HEADER_TIME_FORMAT)
+    except (KeyError, ValueError):
+        post_time = None
+    try:
+        author = fields["作者"]
+        sender = author.split()[0]
+        title = fields["標題"]
+    except (KeyError, IndexError):
+        return None
+    board = None
+    match = RX_HEADER_BOARD.match(author)
+    if match:
+        author, board = match.groups()
+    return ArticleHeader(sender, title, post_time, author, board)
     
 @contextmanager
-def ptt_login(user=None, password=None):
+def ptt_login(user=None, password=None, host="ptt.cc", port=22, record=None,
+              pipelining=True, stats=None):
+    """Login to PTT and yield a :class:`PTTBot`.
+
+    :arg str record: If set, log the session to this file. See
+        :class:`ptt_mail_backup.recorder.RecordingChannel`.
+    :arg Stats stats: Collect counters of the session. See
+        :mod:`ptt_mail_backup.stats`.
+    """
+    # paramiko is slow to import
+    from paramiko.client import SSHClient, AutoAddPolicy # pylint: disable=import-outside-toplevel
     with SSHClient() as client:
         client.set_missing_host_key_policy(AutoAddPolicy)
-        client.connect("ptt.cc", username="bbs", password="")
+        start = time.perf_counter()
+        client.connect(host, port=port, username="bbs", password="")
         with client.invoke_shell() as channel:
-            channel.settimeout(10)
-            bot = PTTBot(channel)
-            try:
+            if stats:
+                stats.add_phase("connect", Counter(
+                    calls=1, seconds=time.perf_counter() - start
+                ))
+            if record:
+                channel = RecordingChannel(channel, record, secrets=[password])
+            bot = PTTBot(channel, pipelining=pipelining, stats=stats)
+            with guard_session(bot):
                 bot.login(user, password)
                 yield bot
-            except:
-                log.info(
-                    "uncaught error, here is the last screen:\n%s",
-                    bot.dump_screen()
-                )
-                raise
+                
+@contextmanager
+def guard_session(bot):
+    """Log the last screen if the block raises, and close the record of the
+    session. Used by login functions."""
+    try:
+        yield
+    except:
+        log.info(
+            "uncaught error, here is the last screen:\n%s",
+            bot.dump_screen()
+        )
+        raise
+    finally:
+        if isinstance(bot.channel, RecordingChannel):
+            bot.channel.close_record()
+    
+class BotScreen(ByteScreen):
+    """A screen recording text drawn on the first and the last line. A
+    marker drawn there by an intermediate screen could be matched by
+    :meth:`BaseBot.drawn` even if it is overwritten in the same packet.
+    """
+    def __init__(self, columns, lines):
+        super().__init__(columns, lines)
+        # line number -> bytes drawn since the last clear_drawn()
+        self.drawn = {0: bytearray(), lines - 1: bytearray()}
+        
+    def draw(self, data):
+        y, x = self.cursor.y, self.cursor.x
+        super().draw(data)
+        if y in self.drawn and y == self.cursor.y:
+            line = self.buffer[y]
+            self.drawn[y] += b"".join(
+                line[i].data.encode("latin-1") for i in range(x, self.cursor.x)
+            )
+            
+    def clear_drawn(self):
+        for drawn in self.drawn.values():
+            drawn.clear()
     
-class PTTBot:
-    def __init__(self, channel):
+class BaseBot:
+    """Screen logic shared by :class:`PTTBot` and
+    :class:`ptt_mail_backup.async_bot.AsyncPTTBot`.
+
+    Methods starting with an underscore are generators. They yield when they
+    need more data and the driver (``run``) sends received data back. Keys
+    passed to :meth:`send` are queued and written by the driver before
+    waiting for data.
+
+    :arg Stats stats: Collect counters of each phase. If not set, the bot
+        creates its own.
+    :arg float timeout: The maximum seconds to wait for the next packet. The
+        actual timeout adapts to the round trip time of the session. See
+        :mod:`ptt_mail_backup.waiting`.
+    """
+    def __init__(self, channel, pipelining=True, stats=None, timeout=10):
         self.channel = channel
-        self.screen = ByteScreen(80, 24)
+        self.pipelining = pipelining
+        self.pending_keys = ""
+        self.outbox = []
+        self.round_trips = 0
+        self.stalls = 0
+        self.stats = stats if stats is not None else Stats()
+        # a stack of [name, counter, resumed_at]
+        self.phases = []
+        self.mail_counter = None
+        self.screen = BotScreen(80, 24)
         self.stream = ByteStream(self.screen, use_c1=False)
         self.stream.select_other_charset("@")
+        # encoded lines. Invalidated by screen.dirty
+        self.line_cache = {}
         self.article_configured = False
         self.user = None
+        self.rtt = RTTEstimator(max_timeout=timeout)
+        # the current wait. See recv_timeout
+        self.wait = None
 
+    @contextmanager
+    def phase(self, name):
+        """Count round trips, traffic, and time in a phase. Nested phases pause
+        the outer one. The counter is added to :attr:`stats` at the end."""
+        now = time.perf_counter()
+        if self.phases:
+            outer = self.phases[-1]
+            outer[1].seconds += now - outer[2]
+        counter = Counter(calls=1)
+        self.phases.append([name, counter, now])
+        try:
+            yield counter
+        finally:
+            now = time.perf_counter()
+            counter.seconds += now - self.phases.pop()[2]
+            if self.phases:
+                self.phases[-1][2] = now
+            self.stats.add_phase(name, counter)
+            
+    @contextmanager
+    def track_mail(self, index):
+        """Count round trips and traffic of a mail. The wall time includes
+        everything done in the block e.g. saving the file."""
+        counter = self.mail_counter = Counter(calls=1)
+        start = time.perf_counter()
+        try:
+            yield counter
+        finally:
+            counter.seconds = time.perf_counter() - start
+            self.mail_counter = None
+            self.stats.add_mail(index, counter)
+            
+    def count(self, field, value=1):
+        if self.phases:
+            counter = self.phases[-1][1]
+            setattr(counter, field, getattr(counter, field) + value)
+        if self.mail_counter:
+            setattr(self.mail_counter, field, getattr(self.mail_counter, field) + value)
+        
     def dump_screen(self):
         """Dump the current screen"""
         return "\n".join(line.decode("big5-uao").rstrip() for line in self.lines())
         
-    def login(self, user=None, password=None):
+    @in_phase("login")
+    def _login(self, user=None, password=None):
         if not user:
             user = input("User: ")
         if not password:
             password = getpass()
         self.user = user
-        self.unt("請輸入代號")
+        # refreshing would press "any key" or input the password
+        yield from self._unt("請輸入代號", refresh=False)
         
         log.info("start login")
         
         self.send(user + "\r" + password + "\r")
         def handle_login(data):
-            if "刪除其他重複登入".encode("big5-uao") in data:
+            found = find_markers(LOGIN_MARKERS, data)
+            if "duplicate" in found:
+                # keep other sessions e.g. parallel workers
+                log.info("duplicate login, keep other sessions")
                 self.send("n\r")
                 
-            if "密碼不對喔！".encode("big5-uao") in data:
-                raise Exception("failed to login. Wrong password.")
-        self.unt("按任意鍵繼續", on_data=handle_login)
+            if "wrong_password" in found:
+                raise LoginError("failed to login. Wrong password.")
+        yield from self._unt("按任意鍵繼續", on_data=handle_login, refresh=False)
         
         log.info("%s login success", user)
         
         self.send(" ")
         def handle_after_login(data):
-            if "編輯器自動復原".encode("big5-uao") in data:
-                raise Exception("failed to login. Unsaved article detected.")
+            found = find_markers(AFTER_LOGIN_MARKERS, data)
+            if not found:
+                return
                 
-            if "您要刪除以上錯誤嘗試的記錄嗎?".encode("big5-uao") in data:
+            if "recover" in found:
+                raise LoginError("failed to login. Unsaved article detected.")
+                
+            if "login_attempts" in found:
                 self.send("n\r")
                 
-            elif re.search(r"您保存信件數目 \d+ 超出上限 \d+".encode("big5-uao"), data):
+            elif "mailbox_full" in found:
                 self.send("qq")
                 
-            elif "新看板，確定要加入我的最愛嗎".encode("big5-uao") in data:
+            elif "new_board" in found:
                 self.send("y\r")
                 
-            elif any(view.encode("big5-uao") in data for view in LOGIN_VIEWS):
+            elif "view" in found:
                 self.send("qq")
-        self.unt(self.detect("主功能表", 0), on_data=handle_after_login)
+        yield from self._unt(
+            self.detect("主功能表", 0), on_data=handle_after_login, refresh=False
+        )
         log.info("enter main menu")
         
     def detect(self, needle, line_no):
         if needle.startswith("!"):
             reverse = True
-            needle = needle[1:].encode("big5-uao")
+            needle = big5(needle[1:])
         else:
             reverse = False
-            needle = needle.encode("big5-uao")
+            needle = big5(needle)
         def callback(_data):
             if reverse:
                 return needle not in self.get_line(line_no)
             return needle in self.get_line(line_no)
         return callback
         
-    def unt(self, needle, on_data=None):
-        should_stop = None
+    def drawn(self, needle, line_no):
+        """Create a predicate matching ``needle`` in text drawn on line
+        ``line_no`` (the first or the last line) during the wait. Unlike a str
+        needle, it doesn't match the article or the mail list. Unlike
+        :meth:`detect`, it still matches if the screen is overwritten in the
+        same packet. Each match consumes the drawn text.
+        """
+        needle = big5(needle)
+        line_no %= self.screen.lines
+        def callback(_data):
+            drawn = self.screen.drawn[line_no]
+            pos = drawn.find(needle)
+            if pos < 0:
+                return False
+            del drawn[:pos + len(needle)]
+            return True
+        return callback
+        
+    def expect(self, needle):
+        """Create a predicate. If ``needle`` is a str, the predicate matches
+        received data without escape sequences, so it should only be used
+        for text that can't appear in mails. Otherwise ``needle`` is a
+        callable which usually matches the screen.
+        """
         if callable(needle):
-            should_stop = needle
-        else:
-            def should_stop(data, test=needle.encode("big5-uao")): # pylint: disable=function-redefined
-                log.debug("unt handler: %r", data)
-                return test in data
+            return needle
+        test = big5(needle)
+        tail = b""
+        def should_stop(data):
+            nonlocal tail
+            log.debug("unt handler: %r", data)
+            # the needle may be split into two packets
+            data = tail + data
+            tail = data[-TAIL_SIZE:]
+            return test in RX_ESCAPE.sub(b"", data)
+        return should_stop
+        
+    def _unt(self, needle, on_data=None, refresh=True):
+        yield from self._unt_all([needle], on_data=on_data, refresh=refresh)
+        
+    def _unt_all(self, needles, on_data=None, refresh=True):
+        """Wait until all needles are matched in order. A needle is only
+        tested after the previous one is matched.
+
+        :arg bool refresh: Redraw the screen if it stops changing before all
+            needles are matched. A refresh doesn't skip needles: a slow
+            response still arrives before the redraw. After all needles are
+            matched, packets are drained until the screen settles, so the
+            redraw doesn't match the next wait.
+        """
+        predicates = [self.expect(n) for n in needles]
+        if not predicates:
+            return
+        self.round_trips += 1
+        self.count("round_trips")
+        self.screen.clear_drawn()
+        self.wait = wait = Wait(self.rtt, refresh=refresh, sample=bool(self.outbox))
+        try:
+            while True:
+                data = yield
+                if not data:
+                    # the screen settled after a refresh
+                    break
+                wait.on_packet()
+                self.count("packets")
+                self.count("bytes_received", len(data))
+                if on_data:
+                    on_data(data)
+                self.stream.feed(data)
+                while predicates and predicates[0](data):
+                    predicates.pop(0)
+                if not predicates:
+                    if not wait.refreshes:
+                        break
+                    wait.settling = True
+        finally:
+            self.wait = None
+            
+    def recv_timeout(self):
+        """Return the seconds the driver should wait for the next packet."""
+        return self.wait.recv_timeout()
+        
+    def on_stall(self):
+        """Called by the driver if no packet arrives in :meth:`recv_timeout`.
+        Queue a key to redraw the screen, or raise :class:`socket.timeout`.
+        Return ``True`` if the wait is finished instead. The driver should
+        send an empty packet to the wait in this case.
+        """
+        wait = self.wait
+        if wait.settling:
+            log.info("screen settled after %s refreshes", wait.refreshes)
+            return True
+        seconds = wait.stalled_seconds()
+        self.stalls += 1
+        self.count("stalls")
+        self.count("stall_seconds", seconds)
+        wait.on_stall()
+        log.info(
+            "screen stalled for %.1fs (rtt %.0fms), refresh (%s/%s)",
+            seconds, (self.rtt.srtt or 0) * 1000, wait.refreshes, wait.max_refreshes
+        )
+        self.send(REFRESH_KEY)
+        return False
                 
-        while True:
-            data = self.channel.recv(math.inf)
-            if on_data:
-                on_data(data)
-            self.stream.feed(data)
-            if should_stop(data):
-                return
+    def _pipeline(self, steps, on_data=None):
+        """Send keys and wait for screens.
+
+        :arg list steps: A list of ``(keys, needle)``. ``needle`` could be
+            ``None`` if the step doesn't need to wait.
+
+        If pipelining is enabled, all keys are sent at once, then needles are
+        matched in order. A needle of an intermediate screen should be a str or
+        :meth:`drawn` since the screen may be overwritten in the same packet.
+        """
+        pending_keys = self.pending_keys
+        self.pending_keys = ""
+        if not self.pipelining:
+            if pending_keys:
+                self.send(pending_keys)
+            for keys, needle in steps:
+                self.send(keys)
+                if needle:
+                    yield from self._unt(needle, on_data=on_data)
+            return
+        self.send(pending_keys + "".join(keys for keys, _needle in steps))
+        yield from self._unt_all([n for _keys, n in steps if n], on_data=on_data)
+        
+    def defer(self, keys):
+        """Send keys with the next :meth:`_pipeline` instead of waiting for
+        the screen now.
+        """
+        self.pending_keys += keys
         
     def send(self, data):
-        pos = 0
-        while True:
-            sent = self.channel.send(data[pos:])
-            pos += sent
-            if pos >= len(data):
-                return
+        """Queue data. It is written by the driver before waiting for the
+        next packet."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.outbox.append(data)
         
-    @contextmanager
-    def enter_mail(self):
+    def pop_outbox(self):
+        data = b"".join(self.outbox)
+        self.outbox.clear()
+        return data
+        
+    @in_phase("enter_mail")
+    def _enter_mail(self):
         self.send(b"\x1am")
-        self.unt("郵件選單")
+        yield from self._unt("郵件選單")
         log.info("get in the mail box")
-        yield
+        
+    @in_phase("leave_mail")
+    def _leave_mail(self):
         self.send("q")
-        self.unt("主功能表")
+        yield from self._unt("主功能表")
         log.info("get out the mail box")
         
-    def get_last_index(self):
+    @in_phase("last_index")
+    def _get_last_index(self):
         log.info("get last index")
         # set_trace()
-        self.send("$h")
-        last_index = None
-        self.unt(self.detect("呼叫小天使", -1))
-        self.send("q")
-        self.unt("鴻雁往返")
+        yield from self._pipeline([
+            ("$h", self.drawn("呼叫小天使", -1)),
+            ("q", self.detect("郵件選單", 0))
+        ])
         last_index, *_args = parse_board_item(self.get_highlight_line())
         log.info("get last index success: %s", last_index)
         return last_index
@@ -190,28 +573,43 @@ class PTTBot:
         return [self.screen.buffer[line_no][i] for i in range(self.screen.columns)]
 
     def get_line(self, line_no):
-        chars = self.get_raw_line(line_no)
-        return "".join(c.data for c in chars).encode("latin-1")
+        if line_no < 0:
+            line_no += self.screen.lines
+        if self.screen.dirty:
+            # drop lines changed since the last call
+            for dirty_line_no in self.screen.dirty:
+                self.line_cache.pop(dirty_line_no, None)
+            self.screen.dirty.clear()
+        line = self.line_cache.get(line_no)
+        if line is None:
+            chars = self.get_raw_line(line_no)
+            line = "".join(c.data for c in chars).encode("latin-1")
+            self.line_cache[line_no] = line
+        return line
         
-    def update_article_config(self):
+    @in_phase("config")
+    def _update_article_config(self):
         """Update article config. It is hard to work with articles containing
         long lines (column > 80).
         """
         log.info("update pmore config")
         self.article_configured = True
         self.send("o")
-        self.unt(self.on_pmore_conf)
+        yield from self._unt(self.on_pmore_conf)
         self.send("wmlq")
-        self.unt(self.in_article())
+        yield from self._unt(self.in_article())
         
     def on_pmore_conf(self, _data):
-        return "piaip's more: pmore 2007+ 設定選項".encode("big5-uao") in self.get_line(-9)
+        return big5("piaip's more: pmore 2007+ 設定選項") in self.get_line(-9)
         
-    def article_refresh(self):
-        self.send("h")
-        self.unt(self.detect("呼叫小天使", -1))
-        self.send("q")
-        self.unt(self.in_article())
+    @in_phase("refresh")
+    def _article_refresh(self):
+        yield from self._pipeline(self.refresh_steps())
+        
+    def refresh_steps(self):
+        """Steps to redraw the article by opening and closing the help
+        screen."""
+        return [("h", self.drawn("呼叫小天使", -1)), ("q", self.in_article())]
         
     def in_article(self):
         return self.detect("瀏覽 第", -1)
@@ -223,75 +621,115 @@ class PTTBot:
                 return line
         raise Exception("Failed to find highlight line")
         
-    def get_article(self, index):
-        log.info("get %sth article", index)
-        self.send(str(index))
-        self.unt("跳至第幾項")
-        self.send("\r")
-        self.unt(self.detect("!跳至第幾項", -1))
-        _no, date, sender, title = parse_board_item(self.get_highlight_line())
-        
-        log.info("title: %s", title)
+    @in_phase("item")
+    def _get_item(self, index):
+        """Move the cursor to ``index`` and parse the mail list item."""
+        yield from self._pipeline([
+            (str(index), self.drawn("跳至第幾項", -1)),
+            ("\r", self.detect("!跳至第幾項", -1))
+        ])
+        return parse_board_item(self.get_highlight_line())
         
-        self.send("x" + self.user + "\r")
-        self.unt(self.detect("標  題:", 2))
-        title = self.get_line(2)[8:].strip()[:-5].strip().decode("big5-uao")
-        self.send("n\r\x18a\r\r")
-        self.unt(self.detect("郵件選單", 0))
+    @in_phase("scan")
+    def _scan_mailbox(self, start=1, end=None):
+        """Read the mail list screen by screen. Return a list of
+        :class:`MailItem` between ``start`` and ``end`` (inclusive).
+        """
+        if end is None:
+            end = yield from self._get_last_index()
+        log.info("scan mailbox %s~%s", start, end)
+        items = {}
+        index = start
+        while index <= end:
+            yield from self._get_item(index)
+            for line in self.lines():
+                if RX_BOARD_ITEM.match(line):
+                    item = parse_board_item(line)
+                    if start <= item.index <= end:
+                        items[item.index] = item
+            if index not in items:
+                raise Exception("Failed to find mail {} in the mail list".format(index))
+            index = max(items) + 1
+            log.info("scan mailbox, found %s items", len(items))
+        return [items[i] for i in sorted(items)]
         
-        article = Article(date, sender, title)
+    @in_phase("article")
+    def _get_article(self, index, sink=None, start_line=0):
+        """Fetch an article.
 
-        self.send("\r")
+        :arg ArticleWriter sink: Write finished lines to the sink while paging.
+            See :class:`ptt_mail_backup.article.Article`.
+        :arg int start_line: Resume an interrupted article from this line. Lines
+            before it must be already written to ``sink``.
+        """
+        log.info("get %sth article", index)
+        round_trips = self.round_trips
+        stalls = self.stalls
+        _no, date, sender, title = yield from self._get_item(index)
         
-        is_animated = False
-        def handle_animated(data):
-            nonlocal is_animated
-            if "這份文件是可播放的文字動畫".encode("big5-uao") in data:
-                log.info("skip animation")
-                self.send("n")
-                is_animated = True
-        self.unt(self.in_article(), on_data=handle_animated)
-        log.info("enter the article. is_animated=%s", is_animated)
-
-        if is_animated:
-            self.article_refresh()
-            log.info("refresh animation page to show ^L code")
+        log.info("title: %s", title)
+        
+        yield from self._open_article([("\r", self.in_article())])
+        header = parse_header([self.get_line(i) for i in range(3)], self.screen.columns)
+        if header:
+            sender, title = header.sender, header.title
+        else:
+            log.info("no header or the title is truncated, try the forward prompt")
+            title = yield from self._get_forward_title()
+            yield from self._open_article([
+                ("n\r\x18a\r\r", self.drawn("郵件選單", 0)),
+                ("\r", self.in_article())
+            ])
+        log.info("full title: %s", title)
+        article = Article(date, sender, title, sink=sink, start_line=start_line)
+        if header:
+            article.time = header.time
+            article.author = header.author
+            article.board = header.board
             
         if not self.article_configured:
-            self.update_article_config()
+            yield from self._update_article_config()
 
         log.info("start collecting body")
-        y = 0
+        y = start_line
         x = 0
+        # lines before this are drawn in full width
+        complete = start_line
+        if y:
+            log.info("resume from line %s", y)
+            with self.phase("page"):
+                yield from self._goto_line(y)
         while True:
             screen = article.add_screen([*self.lines(raw=True)][:-1], y, x)
+            self.count("screens")
             log.info("add screen %s~%s", y + 1, y + self.screen.lines - 1)
             
             indent = 0
-            while any(line.right_truncated for line in screen.lines):
-                truncated_lines = set(line.line_no for line in screen.lines if line.right_truncated)
-            
+            truncated_lines = plan_columns(screen, complete)
+            while truncated_lines:
                 log.info("has truncated lines")
                 indent_count = int(self.screen.columns / 8) - 1
                 if x == 0:
                     # the first indent is shorter
                     x -= 1
-                self.send(">" * indent_count)
                 x += 8 * indent_count
                 indent += indent_count
-                self.article_refresh()
+                with self.phase("scroll"):
+                    yield from self._pipeline([(">" * indent_count, None), *self.refresh_steps()])
                 screen = article.add_screen(
                     [*self.lines(raw=True)][:-1],
                     y,
                     x,
                     skip_line=lambda line: line.line_no not in truncated_lines
                 )
+                self.count("screens")
                 log.info("move right to col %s", x)
+                truncated_lines = plan_columns(screen, complete, truncated_lines)
                 
             log.info("max indent %s", indent)
             if indent:
-                self.send("<" * indent)
-                self.article_refresh()
+                # the screen will be refreshed after moving to the next page
+                self.defer("<" * indent)
                 log.info("back to first col")
                 x = 0
 
@@ -300,28 +738,149 @@ class PTTBot:
             
             if self.on_last_page():
                 break
+            complete = y + self.screen.lines - 1
                 
-            self.send(":{}\r".format(y + 1 + self.screen.lines - 1))
-            self.article_refresh()
+            with self.phase("page"):
+                yield from self._goto_line(y + self.screen.lines - 1)
             if not self.on_last_page():
                 y += self.screen.lines - 1
+                with self.phase("write"):
+                    article.flush(y)
                 continue
                 
-            # return to y and find how many lines are left
-            self.send(":{}\r".format(y + 1))
-            self.article_refresh()
-                
-            scrolls = 0
-            while not self.on_last_page():
-                self.send("j")
-                self.article_refresh()
-                scrolls += 1
-                
-            y += scrolls
-        self.send("q")
+            y = yield from self._find_last_page(y, y + self.screen.lines - 1)
+            with self.phase("write"):
+                article.flush(y)
+        with self.phase("write"):
+            article.flush()
+        yield from self._pipeline([("q", None)])
         
-        log.info("get article success")
+        log.info(
+            "get article success, %s round trips, %s stalls",
+            self.round_trips - round_trips, self.stalls - stalls
+        )
         return article
     
+    @in_phase("open")
+    def _open_article(self, steps):
+        """Send ``steps`` to open the article and skip the animation."""
+        is_animated = False
+        def handle_animated(data):
+            nonlocal is_animated
+            if big5("這份文件是可播放的文字動畫") in data:
+                log.info("skip animation")
+                self.send("n")
+                is_animated = True
+        yield from self._pipeline(steps, on_data=handle_animated)
+        log.info("enter the article. is_animated=%s", is_animated)
+
+        if is_animated:
+            yield from self._article_refresh()
+            log.info("refresh animation page to show ^L code")
+            
+    @in_phase("title")
+    def _get_forward_title(self):
+        """Leave the article and read the full title from the forward prompt.
+        The prompt is left open."""
+        yield from self._pipeline([
+            ("q", self.drawn("郵件選單", 0)),
+            ("x" + self.user + "\r", self.detect("標  題:", 2))
+        ])
+        return self.get_line(2)[8:].strip()[:-5].strip().decode("big5-uao")
+        
+    def _goto_line(self, y):
+        """Scroll the article so line ``y`` (0-based) is at the top."""
+        yield from self._pipeline([(":{}\r".format(y + 1), None), *self.refresh_steps()])
+        
+    @in_phase("last_page")
+    def _find_last_page(self, lo, hi):
+        """Binary search the first line of the last page, which is the same
+        position as scrolling down from ``lo`` line by line until the last
+        page.
+
+        :arg int lo: A line that is not on the last page.
+        :arg int hi: A line that is on the last page. The screen must be
+            showing this line.
+        """
+        current = hi
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            yield from self._goto_line(mid)
+            current = mid
+            if self.on_last_page():
+                hi = mid
+            else:
+                lo = mid
+        if current != hi:
+            yield from self._goto_line(hi)
+        log.info("find last page at line %s", hi)
+        return hi
+        
     def on_last_page(self):
         return RX_LAST_PAGE.search(self.get_line(-1))
+        
+class PTTBot(BaseBot):
+    """A blocking bot working with a paramiko channel."""
+    def run(self, steps):
+        """Drive a generator returned by the underscore methods. Return its
+        return value."""
+        try:
+            steps.send(None)
+            while True:
+                self.write(self.pop_outbox())
+                steps.send(self.recv())
+        except StopIteration as err:
+            self.write(self.pop_outbox())
+            return err.value
+            
+    def recv(self):
+        while True:
+            self.channel.settimeout(self.recv_timeout())
+            try:
+                data = self.channel.recv(math.inf)
+            except socket.timeout:
+                if self.on_stall():
+                    return b""
+                self.write(self.pop_outbox())
+                continue
+            if not data:
+                raise EOFError("channel is closed")
+            return data
+            
+    def write(self, data):
+        if data:
+            self.channel.settimeout(self.rtt.max_timeout)
+        pos = 0
+        while pos < len(data):
+            pos += self.channel.send(data[pos:])
+            
+    def login(self, user=None, password=None):
+        return self.run(self._login(user, password))
+        
+    def unt(self, needle, on_data=None):
+        return self.run(self._unt(needle, on_data=on_data))
+        
+    def pipeline(self, steps, on_data=None):
+        return self.run(self._pipeline(steps, on_data=on_data))
+        
+    @contextmanager
+    def enter_mail(self):
+        self.run(self._enter_mail())
+        yield
+        if not self.channel.closed:
+            self.run(self._leave_mail())
+        
+    def get_last_index(self):
+        return self.run(self._get_last_index())
+        
+    def get_item(self, index):
+        """Move the cursor to ``index`` and parse the mail list item."""
+        return self.run(self._get_item(index))
+        
+    def scan_mailbox(self, start=1, end=None):
+        """See :meth:`BaseBot._scan_mailbox`."""
+        return self.run(self._scan_mailbox(start, end))
+        
+    def get_article(self, index, sink=None, start_line=0):
+        """See :meth:`BaseBot._get_article`."""
+        return self.run(self._get_article(index, sink=sink, start_line=start_line))
@@ -0,0 +1,73 @@
+import json
+import threading
+import time
+
+def encode(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return data.decode("latin-1")
+
+def decode(data):
+    return data.encode("latin-1")
+
+class RecordingChannel:
+    """Wrap a paramiko channel and log every ``send``/``recv`` to a JSON lines
+    file.
+
+    Each line is an object with ``time`` (seconds since the recording
+    started), ``op`` (``send`` or ``recv``) and ``data`` (bytes decoded as
+    latin-1).
+
+    :arg list secrets: Strings that should be masked in sent data e.g. the
+        password.
+    """
+    def __init__(self, channel, path, secrets=()):
+        self.channel = channel
+        self.file = open(path, "w", encoding="utf-8") # pylint: disable=consider-using-with
+        self.secrets = [s.encode("utf-8") for s in secrets if s]
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def write(self, op, data):
+        if op == "send":
+            for secret in self.secrets:
+                data = data.replace(secret, b"*" * len(secret))
+        line = json.dumps({
+            "time": time.perf_counter() - self.start,
+            "op": op,
+            "data": encode(data)
+        })
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def send(self, data):
+        sent = self.channel.send(data)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.write("send", data[:sent])
+        return sent
+
+    def recv(self, nbytes):
+        data = self.channel.recv(nbytes)
+        self.write("recv", data)
+        return data
+
+    def close(self):
+        """Close the channel. The record is closed by :meth:`close_record`."""
+        self.channel.close()
+
+    def close_record(self):
+        self.file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+def load_record(path):
+    """Read a record file. Return a list of ``(time, op, data)``."""
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            events.append((event["time"], event["op"], decode(event["data"])))
+    return events
@@ -0,0 +1,134 @@
+"""Round trips, traffic, and time spent in each phase of a backup.
+
+Phases are nested. Counters and time are exclusive i.e. the time spent in
+``page`` is not counted in ``get_article``, so the phases of a session add up
+to the total.
+"""
+import json
+import threading
+import time
+
+class Counter:
+    FIELDS = (
+        "calls", "seconds", "round_trips", "bytes_received", "packets", "screens",
+        "stalls", "stall_seconds"
+    )
+    __slots__ = FIELDS
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.get(field, 0))
+
+    def add(self, other):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+class Stats:
+    """Collect counters from many sessions. Thread-safe."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.mails = {}
+        self.saved = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def add_phase(self, name, counter):
+        with self.lock:
+            self.phases.setdefault(name, Counter()).add(counter)
+
+    def add_mail(self, index, counter):
+        with self.lock:
+            self.mails.setdefault(index, Counter()).add(counter)
+
+    def add_result(self, name, value=1):
+        """Count mails that are ``saved``, ``skipped``, or ``failed``."""
+        with self.lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def total(self):
+        total = Counter()
+        with self.lock:
+            for counter in self.phases.values():
+                total.add(counter)
+        return total
+
+    def slowest_mails(self, count=10):
+        with self.lock:
+            mails = sorted(self.mails.items(), key=lambda i: i[1].seconds, reverse=True)
+        return mails[:count]
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "seconds": time.perf_counter() - self.start,
+                "saved": self.saved,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "phases": {name: c.as_dict() for name, c in sorted(self.phases.items())},
+                "mails": [
+                    {"index": index, **c.as_dict()}
+                    for index, c in sorted(self.mails.items())
+                ]
+            }
+
+    def to_prometheus(self):
+        """Return the summary in the Prometheus text format. Per mail counters
+        are not included."""
+        data = self.to_dict()
+        lines = [
+            "# HELP ptt_mail_backup_run_seconds Wall time of the backup.",
+            "# TYPE ptt_mail_backup_run_seconds gauge",
+            "ptt_mail_backup_run_seconds {:.6f}".format(data["seconds"]),
+            "# HELP ptt_mail_backup_mails_total Number of fetched mails.",
+            "# TYPE ptt_mail_backup_mails_total counter",
+            "ptt_mail_backup_mails_total {}".format(len(data["mails"]))
+        ]
+        for result in ("saved", "skipped", "failed"):
+            name = "ptt_mail_backup_{}_mails_total".format(result)
+            lines.append("# HELP {} Number of {} mails.".format(name, result))
+            lines.append("# TYPE {} counter".format(name))
+            lines.append("{} {}".format(name, data[result]))
+        for field in Counter.FIELDS:
+            name = "ptt_mail_backup_phase_{}_total".format(field)
+            lines.append("# HELP {} {} in each phase.".format(
+                name, field.replace("_", " ").capitalize()
+            ))
+            lines.append("# TYPE {} counter".format(name))
+            for phase, counter in data["phases"].items():
+                lines.append('{}{{phase="{}"}} {}'.format(name, phase, counter[field]))
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """Save the summary as JSON, or a Prometheus textfile if the extension
+        is ``.prom``."""
+        if str(path).endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def format_profile(self, count=10):
+        """Return a human readable table of phases and the slowest mails."""
+        lines = ["{:<16}{:>8}{:>10}{:>8}{:>12}{:>9}{:>9}{:>8}".format(
+            "phase", "calls", "seconds", "trips", "bytes", "packets", "screens", "stalls"
+        )]
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda i: i[1].seconds, reverse=True)
+        for name, c in phases:
+            lines.append("{:<16}{:>8}{:>10.3f}{:>8}{:>12}{:>9}{:>9}{:>8}".format(
+                name, c.calls, c.seconds, c.round_trips, c.bytes_received,
+                c.packets, c.screens, c.stalls
+            ))
+        lines.append("")
+        lines.append("slowest mails:")
+        for index, c in self.slowest_mails(count):
+            lines.append("{:>8}{:>10.3f}s{:>6} trips{:>10} bytes{:>5} screens{:>3} stalls".format(
+                index, c.seconds, c.round_trips, c.bytes_received, c.screens, c.stalls
+            ))
+        return "\n".join(lines)
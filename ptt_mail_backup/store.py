@@ -0,0 +1,398 @@
+"""Where fetched mails are saved.
+
+A store has four methods:
+
+* ``is_saved(item)`` returns ``True`` if the mail list item can be skipped.
+* ``save(writer, article, index, item=None)`` takes a finished
+  :class:`ptt_mail_backup.article.ArticleWriter`. The writer is committed or
+  aborted by the store.
+* ``saved_items()`` returns a list of
+  :class:`ptt_mail_backup.ptt_bot.MailItem` of saved mails, used by
+  ``--verify``.
+* ``close()`` flushes pending data.
+
+:class:`BackgroundStore` wraps a store so sessions don't wait for the disk.
+:class:`ptt_mail_backup.archive.ArchiveStore` saves mails into a tar or zip
+archive.
+
+Search a SQLite archive with ``python -m ptt_mail_backup.store archive.db
+QUERY``.
+"""
+import argparse
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from .filename import DummyDir, get_filename
+from .ptt_bot import RX_ESCAPE, MailItem, parse_header
+from .stats import Counter
+
+ArchivedMail = namedtuple("ArchivedMail", [
+    "index", "date", "sender", "title", "time", "hash"
+])
+
+def open_store(spec, dest, filename_format, manifest=None, incremental=False):
+    """Create a store from the ``--store`` option.
+
+    :arg str spec: ``files``, ``sqlite:PATH``, or ``archive:PATH``.
+    """
+    if spec == "files":
+        return FileStore(dest, filename_format, manifest)
+    if spec.startswith("sqlite:"):
+        return SQLiteStore(spec[len("sqlite:"):], incremental=incremental)
+    if spec.startswith("archive:"):
+        from .archive import ArchiveStore # pylint: disable=import-outside-toplevel
+        return ArchiveStore(spec[len("archive:"):], filename_format, incremental=incremental)
+    raise Exception("unknown store: {}".format(spec))
+
+def to_text(content):
+    """Decode article bytes to plain text without ANSI escapes."""
+    return RX_ESCAPE.sub(b"", content).decode("big5-uao", "replace")
+
+RX_FILENAME_INDEX = re.compile(r"\d+")
+
+RX_EXTENSION = re.compile(r"\.\w+")
+
+def read_saved_item(path):
+    """Read the index from the filename and the date, sender, and title from
+    the article header. Unknown fields are ``None``. The title is the
+    filename if the header is missing."""
+    match = RX_FILENAME_INDEX.match(path.name)
+    index = int(match.group()) if match else None
+    with open(path, "rb") as f:
+        lines = RX_ESCAPE.sub(b"", f.read(1024)).split(b"\r\n")
+    header = parse_header(lines, columns=math.inf) if len(lines) > 3 else None
+    if not header:
+        return MailItem(index, None, None, path.name)
+    date = "{}/{:02d}".format(header.time.month, header.time.day) if header.time else None
+    return MailItem(index, date, header.sender, header.title)
+
+class FileStore:
+    """Save each mail to a file in ``dest``.
+
+    :arg Manifest manifest: If set, saved mails are recorded and skipped.
+    """
+    def __init__(self, dest, filename_format, manifest=None):
+        self.dest = dest
+        self.filename_format = filename_format
+        self.manifest = manifest
+
+    def is_saved(self, item):
+        """Return ``True`` if the mail list item is already saved. If the mail
+        was saved with a different index, the file is renamed.
+        """
+        if not self.manifest:
+            return False
+        index = item[0]
+        with self.manifest.lock:
+            record = self.manifest.match(item)
+            if not record:
+                return False
+            if record.index != index:
+                content = self.dest.joinpath(record.filename).read_bytes()
+                filename = get_filename(
+                    content, record._replace(title=record.full_title), index,
+                    self.filename_format
+                )
+                self.manifest.move(record, index, filename)
+                print("Mail moved: {} -> {}".format(record.index, index))
+            else:
+                print("Skip saved mail: {}".format(index))
+        return True
+
+    def save(self, writer, article, index, item=None):
+        """Move the file into place.
+
+        :arg MailItem item: The mail list item. Required if ``manifest`` is set.
+        """
+        with writer:
+            filename = get_filename(writer.read_bytes, article, index, self.filename_format)
+            writer.commit(self.dest / filename)
+        if self.manifest:
+            with self.manifest.lock:
+                self.manifest.add(item, article, writer.hash.hexdigest(), filename)
+
+    def saved_items(self):
+        """Return records in the manifest, or read files in ``dest`` if there
+        is no manifest. Only files with the extension of the filename format
+        are read, so outputs of ``convert`` are ignored."""
+        if self.manifest:
+            with self.manifest.lock:
+                return [
+                    MailItem(r.index, r.date, r.sender, r.title)
+                    for r in self.manifest.records.values() if self.manifest.exists(r)
+                ]
+        ext = os.path.splitext(self.filename_format)[1]
+        if not RX_EXTENSION.fullmatch(ext):
+            # the format has no extension
+            ext = None
+        return [
+            read_saved_item(path) for path in sorted(self.dest.iterdir())
+            if path.is_file() and not path.name.startswith(".") and
+            (not ext or path.suffix == ext)
+        ]
+
+    def close(self):
+        if self.manifest:
+            self.manifest.save()
+
+class SQLiteStore:
+    """Save mails to a SQLite database.
+
+    Raw bytes and the decoded text are stored in the ``content`` table, keyed
+    by SHA-1, so fetching the same mail again only adds a row to the ``mail``
+    table. The text is indexed with FTS5 if it is available. Rows are
+    inserted in batches of ``batch_size`` in a single transaction.
+
+    :arg bool incremental: Skip mail list items that are already in the
+        archive.
+    """
+    def __init__(self, path, incremental=False, batch_size=100):
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.incremental = incremental
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+        self.fts = False
+        self.create_tables()
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS content (
+                    id INTEGER PRIMARY KEY,
+                    hash TEXT NOT NULL UNIQUE,
+                    data BLOB NOT NULL,
+                    text TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS mail (
+                    id INTEGER PRIMARY KEY,
+                    `index` INTEGER,
+                    date TEXT,
+                    sender TEXT,
+                    title TEXT,
+                    list_sender TEXT,
+                    list_title TEXT,
+                    time TEXT,
+                    hash TEXT NOT NULL REFERENCES content (hash),
+                    UNIQUE (date, sender, title, hash)
+                );
+            """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(mail)")]
+        if "list_sender" not in columns:
+            # created before list_sender. The sender in the header is the best
+            # guess
+            with self.conn:
+                self.conn.execute("ALTER TABLE mail ADD COLUMN list_sender TEXT")
+                self.conn.execute(
+                    "UPDATE mail SET list_sender = sender WHERE list_title IS NOT NULL"
+                )
+        with self.conn:
+            self.conn.executescript("""
+                DROP INDEX IF EXISTS mail_list;
+                CREATE INDEX IF NOT EXISTS mail_item ON mail (date, list_sender, list_title);
+            """)
+        self.fts = self.has_table("content_fts")
+        if self.fts:
+            return
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        "CREATE VIRTUAL TABLE content_fts USING fts5 "
+                        "(text, content='content', content_rowid='id', "
+                        "tokenize='{}')".format(tokenizer)
+                    )
+                    self.conn.execute(
+                        "CREATE TRIGGER content_fts_insert AFTER INSERT ON content "
+                        "BEGIN INSERT INTO content_fts (rowid, text) "
+                        "VALUES (new.id, new.text); END"
+                    )
+            except sqlite3.OperationalError:
+                # the tokenizer or FTS5 is not available
+                continue
+            self.fts = True
+            break
+
+    def has_table(self, name):
+        return bool(self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+        ).fetchone())
+
+    def is_saved(self, item):
+        if not self.incremental:
+            return False
+        index, date, sender, title = item
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM mail WHERE date = ? AND list_sender = ? AND list_title = ?",
+                (date, sender, title)
+            ).fetchone()
+        if row:
+            print("Skip saved mail: {}".format(index))
+        return bool(row)
+
+    def save(self, writer, article, index, item=None):
+        """Queue the mail and remove the temporary file."""
+        with writer:
+            content = writer.read_bytes()
+        sha1 = writer.hash.hexdigest()
+        mail = (
+            index, article.date, article.sender, article.title,
+            # the sender in the header differs for forwarded mails
+            item[2] if item else None,
+            item[3] if item else None,
+            DummyDir(article).getTime(None).isoformat(), sha1
+        )
+        with self.lock:
+            self.pending.append((sha1, content, mail))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Insert pending mails in one transaction. The caller must hold
+        :attr:`lock`."""
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO content (hash, data, text) VALUES (?, ?, ?)",
+                [(sha1, content, to_text(content)) for sha1, content, _mail in self.pending]
+            )
+            self.conn.executemany(
+                "INSERT INTO mail "
+                "(`index`, date, sender, title, list_sender, list_title, time, hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (date, sender, title, hash) "
+                "DO UPDATE SET `index` = excluded.`index`",
+                [mail for _sha1, _content, mail in self.pending]
+            )
+        self.pending.clear()
+
+    def saved_items(self):
+        with self.lock:
+            self.flush()
+            return [MailItem(*row) for row in self.conn.execute(
+                "SELECT `index`, date, coalesce(list_sender, sender), "
+                "coalesce(list_title, title) FROM mail"
+            )]
+
+    def close(self):
+        with self.lock:
+            self.flush()
+        self.conn.close()
+
+    def search(self, query, limit=50):
+        """Find mails containing ``query``. Return a list of
+        :class:`ArchivedMail`."""
+        columns = "m.`index`, m.date, m.sender, m.title, m.time, m.hash"
+        # the trigram tokenizer can't match less than 3 characters
+        if self.fts and len(query) >= 3:
+            sql = (
+                "SELECT {} FROM content_fts "
+                "JOIN content c ON c.id = content_fts.rowid "
+                "JOIN mail m ON m.hash = c.hash "
+                "WHERE content_fts MATCH ? ORDER BY rank LIMIT ?"
+            ).format(columns)
+            params = ('"{}"'.format(query.replace('"', '""')), limit)
+        else:
+            sql = (
+                "SELECT {} FROM content c JOIN mail m ON m.hash = c.hash "
+                "WHERE instr(c.text, ?) ORDER BY m.time DESC LIMIT ?"
+            ).format(columns)
+            params = (query, limit)
+        with self.lock:
+            return [ArchivedMail(*row) for row in self.conn.execute(sql, params)]
+
+    def get_content(self, sha1):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM content WHERE hash = ?", (sha1,)
+            ).fetchone()
+        return row[0] if row else None
+
+class BackgroundStore:
+    """Save mails with a pool of threads.
+
+    :meth:`save` puts the mail in a bounded queue and returns immediately,
+    unless the queue is full. Call :meth:`join` to wait for pending mails. The
+    first error raised by the store is raised again by :meth:`join`.
+
+    :arg Stats stats: Add the time spent in ``store.save`` to the ``save``
+        phase, and count saved, skipped, and failed mails.
+    """
+    def __init__(self, store, workers=2, maxsize=16, stats=None):
+        self.store = store
+        self.stats = stats
+        self.queue = queue.Queue(maxsize)
+        self.errors = []
+        self.threads = [
+            threading.Thread(target=self.run, daemon=True) for _i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def is_saved(self, item):
+        saved = self.store.is_saved(item)
+        if saved and self.stats:
+            self.stats.add_result("skipped")
+        return saved
+
+    def save(self, writer, article, index, item=None):
+        self.queue.put((writer, article, index, item))
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            writer, _article, index, _item = job
+            start = time.perf_counter()
+            result = "saved"
+            try:
+                self.store.save(*job)
+            except Exception as err: # pylint: disable=broad-except
+                print("Failed to save mail {}: {!r}".format(index, err))
+                self.errors.append(err)
+                result = "failed"
+                if not writer.file.closed:
+                    writer.abort()
+            if self.stats:
+                self.stats.add_phase("save", Counter(
+                    calls=1, seconds=time.perf_counter() - start
+                ))
+                self.stats.add_result(result)
+
+    def join(self):
+        for _thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a SQLite mail archive.")
+    parser.add_argument("path", help="the database created by --store sqlite:PATH")
+    parser.add_argument("query")
+    parser.add_argument("-n", "--limit", type=int, default=50, help="Default: %(default)r")
+    args = parser.parse_args()
+
+    store = SQLiteStore(args.path)
+    try:
+        for mail in store.search(args.query, args.limit):
+            print("{:>6} {:%Y-%m-%d} {:<13} {}".format(
+                mail.index, datetime.fromisoformat(mail.time), mail.sender,
+                mail.title
+            ))
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Decide how long a bot waits for the next packet.
+
+Every :meth:`ptt_mail_backup.ptt_bot.BaseBot._unt_all` call is a
+:class:`Wait`. The driver blocks for :meth:`Wait.recv_timeout`. If the screen
+stops changing for that long and the wait isn't finished, the wait is
+stalled: the bot redraws the screen with ``Ctrl-L`` and waits again, in case
+the screen wasn't redrawn by the server. After ``max_refreshes`` stalls, or if
+the whole wait exceeds its deadline, :class:`socket.timeout` is raised and the
+session is reconnected.
+
+The response may just be slow, and the redraw arrives after it. So after a
+refresh, the wait is *settling* once all markers are matched: packets are
+drained until the screen stops changing, then the wait finishes.
+
+The idle timeout adapts to the session with :class:`RTTEstimator`, so stalls
+are detected in a few round trips on a fast server, and slow servers are not
+refreshed too early.
+"""
+import socket
+import time
+
+class RTTEstimator:
+    """Estimate the round trip time of a session like TCP (RFC 6298).
+
+    :arg float initial: The timeout before any sample.
+    :arg float min_timeout: The lower bound of the timeout.
+    :arg float max_timeout: The upper bound of the timeout.
+    """
+    def __init__(self, initial=3, min_timeout=1, max_timeout=10):
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def add_sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.samples += 1
+
+    def timeout(self):
+        if self.srtt is None:
+            timeout = self.initial
+        else:
+            timeout = self.srtt + 4 * self.rttvar
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+class Wait:
+    """The state of a wait.
+
+    :arg RTTEstimator rtt: The estimator of the session.
+    :arg float deadline: The maximum seconds of the wait, even if packets
+        keep coming.
+    :arg bool refresh: Whether the screen could be redrawn on stalls. If not,
+        the wait blocks for ``rtt.max_timeout`` before giving up.
+    :arg bool sample: Whether the first packet is a response to keys sent at
+        the start, and could be used as an RTT sample.
+    """
+    def __init__(self, rtt, deadline=60, refresh=True, max_refreshes=3,
+                 sample=True):
+        self.rtt = rtt
+        self.start = self.listen_start = time.perf_counter()
+        self.deadline = self.start + deadline
+        self.refresh = refresh
+        self.max_refreshes = max_refreshes
+        self.sample = sample
+        self.refreshes = 0
+        self.packets = 0
+        self.settling = False
+
+    def idle_timeout(self):
+        if not self.refresh:
+            return self.rtt.max_timeout
+        if self.settling:
+            # the redraw follows the last response
+            return self.rtt.timeout()
+        # back off after each refresh
+        return min(self.rtt.timeout() * 2 ** self.refreshes, self.rtt.max_timeout)
+
+    def recv_timeout(self):
+        """Return the seconds the driver should block for the next packet.
+        Raise :class:`socket.timeout` if the deadline is exceeded."""
+        now = self.listen_start = time.perf_counter()
+        if now >= self.deadline:
+            raise socket.timeout("wait exceeded the deadline ({:.1f}s)".format(
+                now - self.start
+            ))
+        return min(self.idle_timeout(), self.deadline - now)
+
+    def on_packet(self):
+        self.packets += 1
+        if self.packets == 1 and self.sample and not self.refreshes:
+            # Karn's algorithm: responses after a refresh are ambiguous
+            self.rtt.add_sample(time.perf_counter() - self.start)
+
+    def stalled_seconds(self):
+        return time.perf_counter() - self.listen_start
+
+    def on_stall(self):
+        """Count a refresh. Raise :class:`socket.timeout` if the screen can't
+        be refreshed again."""
+        if not self.refresh or self.refreshes >= self.max_refreshes:
+            raise socket.timeout("no response in {:.1f}s after {} refreshes".format(
+                self.stalled_seconds(), self.refreshes
+            ))
+        self.refreshes += 1
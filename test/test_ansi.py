@@ -0,0 +1,24 @@
+import random
+
+from ptt_mail_backup.ansi import chars_to_bytes
+from ptt_mail_backup.article import ArticleLine
+from ptt_mail_backup.ptt_bot import PTTBot
+
+def random_ansi(rng):
+    out = []
+    for _i in range(23):
+        for _j in range(rng.randrange(60)):
+            if rng.random() < 0.3:
+                codes = rng.sample(["0", "1", "5", "7", "31", "32", "37", "40", "44", "47"], 2)
+                out.append("\x1b[{}m".format(";".join(codes)).encode())
+            out.append(rng.choice([b"a", b" ", "限".encode("big5-uao")]))
+        out.append(b"\r\n")
+    return b"".join(out)
+
+def test_cells_to_bytes():
+    rng = random.Random(1)
+    for _i in range(20):
+        bot = PTTBot(None)
+        bot.stream.feed(random_ansi(rng))
+        for line in bot.lines(raw=True):
+            assert ArticleLine(line).to_bytes() == chars_to_bytes(line)
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from ptt_mail_backup.ansi import chars_to_bytes
+from ptt_mail_backup.article import Article, ArticleWriter
+from ptt_mail_backup.filename import get_filename
+from ptt_mail_backup.ptt_bot import PTTBot
+
+def screen_lines(data):
+    bot = PTTBot(None)
+    bot.stream.feed(data)
+    return [*bot.lines(raw=True)][:-1]
+
+def test_to_bytes():
+    lines = screen_lines(
+        b"plain\r\n\x1b[1;33;41mcolor\x1b[m \x1b[5;32mblink\x1b[m\r\n" +
+        "限".encode("big5-uao") + b"\x1b[7mreverse"
+    )
+    article = Article("6/12", "foo", "bar")
+    article.add_screen(lines, 0, 0)
+    assert article.to_bytes() == b"\r\n".join(chars_to_bytes(l).rstrip() for l in lines)
+    assert article.to_bytes().startswith(b"plain\r\n\x1b[1;33;41mcolor\x1b[m \x1b[5;32mblink")
+
+def test_draw_empty_cells_only():
+    article = Article("6/12", "foo", "bar")
+    article.add_screen(screen_lines(b"foo"), 0, 0)
+    article.add_screen(screen_lines(b"baz"), 30, 10)
+    assert article.to_bytes().split(b"\r\n")[30] == b" " * 10 + b"baz"
+    
+    article.add_screen(screen_lines(b"abcdefghijklmnop"), 30, 0)
+    lines = article.to_bytes().split(b"\r\n")
+    assert lines[0] == b"foo"
+    assert lines[30] == b"abcdefghijbaz"
+
+def test_writer(tmp_path):
+    screens = [(b"foo\r\nbar", 0), (b"baz", 23), (b"\x1b[31mred", 30)]
+    expected = Article("6/12", "foo", "bar")
+    with ArticleWriter(tmp_path) as writer:
+        article = Article("6/12", "foo", "bar", sink=writer)
+        for data, y in screens:
+            for a in (article, expected):
+                a.add_screen(screen_lines(data), y, 0)
+            article.flush(y)
+            assert all(line is None for line in article.lines[:y])
+        article.flush()
+        writer.commit(tmp_path / "article.ans")
+    assert tmp_path.joinpath("article.ans").read_bytes() == expected.to_bytes()
+    assert [p.name for p in tmp_path.iterdir()] == ["article.ans"]
+
+def test_writer_abort(tmp_path):
+    try:
+        with ArticleWriter(tmp_path) as writer:
+            writer.write_line(b"foo")
+            raise ValueError
+    except ValueError:
+        pass
+    assert not list(tmp_path.iterdir())
+
+def test_get_filename():
+    content = (
+        "作者: user1 (nick) 看板: Test\r\n標題: Re: 測試\r\n"
+        "時間: Sun Jun 10 12:00:00 2018\r\n─────\r\n內文"
+    ).encode("big5-uao")
+    filename_format = "{index}. [{board}] {title} [{author}] ({time:%Y%m%d%H%M%S}).ans"
+    article = Article("6/10", "user1", "Re: 測試")
+    parsed = get_filename(content, article, 5, filename_format)
+    assert parsed == "5. [Test] Re： 測試 [user1 (nick)] (20180610120000).ans"
+    article.author = "user1 (nick)"
+    article.board = "Test"
+    article.time = datetime(2018, 6, 10, 12)
+    assert get_filename(None, article, 5, filename_format) == parsed
+    
+def test_get_filename_board_in_signature():
+    # a forwarded mail. The board is only in the signature
+    content = (
+        "作者: user1 (nick)\r\n標題: Fw: 測試\r\n"
+        "時間: Sun Jun 10 12:00:00 2018\r\n─────\r\n內文\r\n\r\n--\r\n"
+        "※ 發信站: 批踢踢實業坊(ptt.cc), 來自: 1.2.3.4\r\n"
+        "※ 文章網址: https://www.ptt.cc/bbs/Gossiping/M.1528632000.A.123.html\r\n"
+    ).encode("big5-uao")
+    filename_format = "{index}. [{board}] {title} [{author}] ({time:%Y%m%d%H%M%S}).ans"
+    article = Article("6/10", "user2", "Fw: 測試")
+    parsed = get_filename(content, article, 5, filename_format)
+    assert parsed == "5. [Gossiping] Fw： 測試 [user1 (nick)] (20180610120000).ans"
+    article.author = "user1 (nick)"
+    article.time = datetime(2018, 6, 10, 12)
+    assert get_filename(content, article, 5, filename_format) == parsed
+    assert get_filename(None, article, 5, "{index}. {title}.ans") == "5. Fw： 測試.ans"
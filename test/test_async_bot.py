@@ -0,0 +1,26 @@
+import asyncio
+
+from ptt_mail_backup.async_bot import RateLimiter, async_ptt_login
+from ptt_mail_backup.fake_server import FakePTT, FakeServer, sample_mails
+from ptt_mail_backup.ptt_bot import ptt_login
+
+def test_async_bot():
+    mails = sample_mails(6)
+    with FakeServer(lambda: FakePTT(mails), latency=0.01) as server:
+        with ptt_login("user", "pass", server.host, server.port) as bot:
+            with bot.enter_mail():
+                expected = [bot.get_article(i).to_bytes() for i in range(1, 7)]
+
+        async def backup(limiter):
+            async with async_ptt_login(
+                    "user", "pass", server.host, server.port, limiter=limiter) as bot:
+                async with bot.enter_mail():
+                    assert await bot.get_last_index() == 6
+                    return [(await bot.get_article(i)).to_bytes() for i in range(1, 7)]
+
+        async def main():
+            limiter = RateLimiter(1000)
+            return await asyncio.gather(*(backup(limiter) for _i in range(4)))
+
+        results = asyncio.run(main())
+    assert results == [expected] * 4
@@ -0,0 +1,157 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from ptt_mail_backup import build_parser
+from ptt_mail_backup.cli import run_session
+from ptt_mail_backup.batch import SessionLimiter, load_accounts, run_batch
+from ptt_mail_backup.fake_server import FakePTT, FakeServer, sample_mails
+from ptt_mail_backup.store import FileStore
+
+CONFIG = """
+[DEFAULT]
+password = pass
+range = all
+
+[alice]
+filename_format = {index}.ans
+
+[bob]
+range = 1 2, 0 0
+workers = 2
+
+[carol]
+password = wrong
+"""
+
+def test_run_batch(tmp_path, capsys):
+    mails = sample_mails(4)
+    config = tmp_path / "accounts.ini"
+    config.write_text(CONFIG, "utf-8")
+    dest = tmp_path / "backup"
+    with FakeServer(lambda: FakePTT(mails, password="pass")) as server:
+        args = build_parser().parse_args([
+            "--batch", str(config), "-d", str(dest), "--host", server.host,
+            "--port", str(server.port), "--max-sessions", "2",
+            "--login-interval", "0"
+        ])
+        accounts = dict(load_accounts(args.batch, args))
+        assert accounts["bob"].range == [[1, 2], [0, 0]]
+        assert accounts["bob"].incremental
+        assert accounts["alice"].all
+
+        assert run_batch(args) == 1
+        assert sorted(p.name for p in (dest / "alice").glob("*.ans")) == [
+            "1.ans", "2.ans", "3.ans", "4.ans"
+        ]
+        assert len(list((dest / "bob").glob("*.ans"))) == 3
+        assert not list((dest / "carol").glob("*.ans"))
+        out = capsys.readouterr().out
+        assert "1 of 3 accounts failed: carol" in out
+
+        assert run_batch(args) == 1
+        out = capsys.readouterr().out
+    summary = out[out.index("account "):].splitlines()
+    assert summary[1].split()[:4] == ["alice", "0", "4", "0"]
+    assert summary[2].split()[:4] == ["bob", "0", "3", "0"]
+
+def test_session_limiter():
+    limiter = SessionLimiter(2, interval=0.05)
+    active = []
+    peak = []
+    logins = []
+    lock = threading.Lock()
+    def session():
+        with limiter.session("ptt.cc"):
+            with lock:
+                logins.append(time.monotonic())
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.1)
+            with lock:
+                active.pop()
+    threads = [threading.Thread(target=session) for _i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    assert all(b - a >= 0.04 for a, b in zip(logins, logins[1:]))
+
+def test_session_queue_drained_while_waiting():
+    indexes = queue.Queue()
+    indexes.put((1, None))
+    args = build_parser().parse_args([
+        "-u", "user", "-p", "pass", "--all", "--host", "127.0.0.1",
+        "--port", "1", "--retries", "0"
+    ])
+    args.limiter = SessionLimiter(1)
+    slot = args.limiter.acquire(args.host)
+    # another session fetches the last mail while holding the slot
+    timer = threading.Timer(0.2, indexes.get)
+    timer.start()
+    # return without connecting to the unreachable host
+    run_session(args, 1, ".", None, indexes, {})
+    timer.join()
+    slot.release()
+    assert args.limiter.acquire(args.host, timeout=0)
+
+def run_in_thread(target, *args, timeout=60):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(target(*args)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "hung"
+    return result[0]
+
+@pytest.mark.parametrize("accounts,max_sessions", [(1, 1), (2, 2)])
+def test_run_batch_few_sessions(tmp_path, accounts, max_sessions):
+    config = tmp_path / "accounts.ini"
+    config.write_text("[DEFAULT]\npassword = pass\nrange = all\nworkers = 2\n" + "".join(
+        "[user{}]\n".format(i) for i in range(accounts)
+    ), "utf-8")
+    dest = tmp_path / "backup"
+    with FakeServer(lambda: FakePTT(sample_mails(4), password="pass")) as server:
+        args = build_parser().parse_args([
+            "--batch", str(config), "-d", str(dest), "--host", server.host,
+            "--port", str(server.port), "--max-sessions", str(max_sessions),
+            "--login-interval", "0"
+        ])
+        assert run_in_thread(run_batch, args) == 0
+    for i in range(accounts):
+        assert len(list((dest / "user{}".format(i)).glob("*.ans"))) == 4
+
+class BrokenBot:
+    """A session in the mail box which is broken."""
+    class channel: # pylint: disable=invalid-name
+        @staticmethod
+        def close():
+            pass
+
+    @contextmanager
+    def track_mail(self, _index):
+        yield
+
+    def get_article(self, _index, **_kwargs):
+        raise EOFError("channel is closed")
+
+def test_reconnect_with_one_slot(tmp_path):
+    indexes = queue.Queue()
+    indexes.put((1, None))
+    with FakeServer(lambda: FakePTT(sample_mails(2), password="pass")) as server:
+        args = build_parser().parse_args([
+            "-u", "user", "-p", "pass", "--all", "--host", server.host,
+            "--port", str(server.port)
+        ])
+        args.limiter = SessionLimiter(1)
+        # the slot of the broken session is given to the new session
+        slot = args.limiter.acquire(args.host)
+        store = FileStore(tmp_path, "{index}.ans")
+        run_in_thread(
+            run_session, args, 0, tmp_path, store, indexes, {}, None,
+            BrokenBot(), slot
+        )
+    assert [p.name for p in tmp_path.glob("*.ans")] == ["1.ans"]
@@ -0,0 +1,51 @@
+import os
+import random
+
+from test_ansi import random_ansi
+
+from ptt_mail_backup.ansi import char_to_color, chars_to_bytes
+from ptt_mail_backup.convert import decode_runs, iter_runs, main, render_html
+from ptt_mail_backup.ptt_bot import PTTBot
+
+def test_iter_runs():
+    rng = random.Random(2)
+    for _i in range(20):
+        bot = PTTBot(None)
+        bot.stream.feed(random_ansi(rng))
+        for line in bot.lines(raw=True):
+            cells = [(char_to_color(c), c.data.encode("latin-1")) for c in line]
+            assert decode_runs(iter_runs(chars_to_bytes(line))) == decode_runs(cells)
+
+def test_half_colored_char():
+    data = "\x1b[1;31m限\x1b[m".encode("big5-uao")
+    # color the second byte
+    data = data[:-4] + b"\x1b[32m" + data[-4:-3] + b"\x1b[m"
+    runs = decode_runs(iter_runs(data))
+    assert [text for _color, text in runs] == ["限"]
+    assert '<span class="hl f1">限</span>' in render_html(runs)
+
+def test_convert(tmp_path, capsys):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    for i in range(6):
+        path = src / ("sub" if i % 2 else "") / "{}. <標題>.ans".format(i)
+        path.write_bytes("\x1b[1;33m公告\x1b[m {}\r\n第二行".format(i).encode("big5-uao"))
+    out = tmp_path / "out"
+
+    assert main([str(src), "-o", str(out), "-j", "2", "--chunk-size", "2"]) == 0
+    assert "Converted 6 files, skipped 0" in capsys.readouterr().out
+    assert (out / "sub" / "1. <標題>.txt").read_text("utf-8") == "公告 1\n第二行"
+    html = (out / "0. <標題>.html").read_text("utf-8")
+    assert "<title>0. &lt;標題&gt;</title>" in html
+    assert '<span class="hl f3">公告</span> 0\n第二行</pre>' in html
+
+    source = src / "0. <標題>.ans"
+    mtime = (out / "0. <標題>.txt").stat().st_mtime + 10
+    os.utime(source, (mtime, mtime))
+    assert main([str(src), "-o", str(out), "-j", "1"]) == 0
+    assert "Converted 1 files, skipped 5" in capsys.readouterr().out
+
+    assert main([str(source), "--format", "txt"]) == 0
+    assert sorted(p.name for p in src.iterdir()) == [
+        "0. <標題>.ans", "0. <標題>.txt", "2. <標題>.ans", "4. <標題>.ans", "sub"
+    ]
@@ -0,0 +1,51 @@
+import io
+import socket
+import threading
+
+from ptt_mail_backup import build_parser
+from ptt_mail_backup.daemon import Daemon, send_job
+from ptt_mail_backup.fake_server import FakePTT, FakeServer, sample_mails
+
+def test_daemon(tmp_path):
+    mails = sample_mails(4)
+    sessions = []
+    def create_session():
+        sessions.append(FakePTT(mails))
+        return sessions[-1]
+    path = str(tmp_path / "ptt.sock")
+    dest = tmp_path / "backup"
+    out = io.StringIO()
+    with FakeServer(create_session) as server:
+        args = build_parser().parse_args([
+            "-u", "user", "-p", "pass", "--host", server.host,
+            "--port", str(server.port), "--daemon", path
+        ])
+        daemon = Daemon(args)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            while not daemon.running:
+                thread.join(0.1)
+            argv = ["--connect", path, "-d", str(dest), "-r", "1", "2"]
+            assert send_job(path, argv, out=out) == 0
+            argv = ["-d", str(dest), "--all", "--incremental"]
+            assert send_job(path, argv, out=out) == 0
+            assert send_job(path, ["-d", str(dest)], out=out) == 2
+            # bad clients don't stop the daemon
+            for request in [b"", b"not json\n", b"[]\n", b'{"argv": "-d"}\n']:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                    conn.connect(path)
+                    conn.sendall(request)
+                    conn.shutdown(socket.SHUT_WR)
+                    assert conn.makefile("rb").read() == b'{"exit": 2}\n'
+            assert send_job(path, ["-d", str(dest), "-r", "1", "1"], out=out) == 0
+        finally:
+            send_job(path, [], stop=True, out=out)
+            thread.join()
+    out = out.getvalue()
+    assert "Fetching mail: 2\n" in out
+    assert "Fetching mail: 4\n" in out
+    assert "one of the arguments -r/--range --all is required" in out
+    assert len(list(dest.glob("*.ans"))) == 4
+    # all jobs share one session
+    assert len(sessions) == 1
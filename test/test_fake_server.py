@@ -0,0 +1,171 @@
+import re
+import time
+from datetime import datetime
+
+import pytest
+
+from ptt_mail_backup.article import ArticleWriter
+from ptt_mail_backup.fake_server import (
+    FakePTT, FakeServer, Mail, ReplayPTT, big5, make_mail, sample_mails
+)
+from ptt_mail_backup.ptt_bot import ptt_login
+from ptt_mail_backup.stats import Stats
+
+def strip_color(b):
+    return re.sub(rb"\x1b\[[\d;]*m", b"", b)
+
+def plain_text(lines):
+    # short articles are padded with empty lines
+    return b"\n".join(strip_color(line).rstrip() for line in lines).rstrip()
+
+@pytest.fixture(name="mails", scope="module")
+def fixture_mails():
+    return sample_mails(8)
+
+def fetch(server, indexes, record=None):
+    with ptt_login("user", "pass", server.host, server.port, record) as bot:
+        with bot.enter_mail():
+            assert bot.get_last_index() == 8
+            return [bot.get_article(i) for i in indexes]
+
+def test_get_article(mails):
+    def create_session():
+        return FakePTT(mails, duplicate_login=True, login_view=True)
+    with FakeServer(create_session) as server:
+        articles = fetch(server, range(1, 9))
+    for mail, article in zip(mails, articles):
+        assert article.title == mail.title
+        assert article.sender == mail.sender
+        assert article.time == datetime(2018, 6, 10, 12)
+        assert plain_text(article.to_bytes().split(b"\r\n")) == plain_text(mail.lines)
+
+def test_replay(mails, tmp_path):
+    record = tmp_path / "record.jsonl"
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        expected = [a.to_bytes() for a in fetch(server, [1, 2], str(record))]
+    assert b"pass" not in record.read_bytes()
+    
+    with FakeServer(lambda: ReplayPTT(record)) as server:
+        assert [a.to_bytes() for a in fetch(server, [1, 2])] == expected
+    
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        with ptt_login("user", "pass", server.host, server.port, str(record)) as bot:
+            with bot.enter_mail():
+                # drop a broken session
+                bot.channel.close()
+                assert bot.channel.closed
+
+def test_scan_mailbox():
+    mails = sample_mails(45)
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        with ptt_login("user", "pass", server.host, server.port) as bot:
+            with bot.enter_mail():
+                items = bot.scan_mailbox()
+                partial = bot.scan_mailbox(15, 25)
+    assert [(i.index, i.date, i.sender, i.title) for i in items] == [
+        (i, m.date, m.sender, m.title) for i, m in enumerate(mails, 1)
+    ]
+    assert partial == items[14:25]
+
+def test_pipelining(mails):
+    results = []
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        for pipelining in (False, True):
+            with ptt_login("user", "pass", server.host, server.port,
+                           pipelining=pipelining) as bot:
+                with bot.enter_mail():
+                    round_trips = bot.round_trips
+                    content = bot.get_article(1).to_bytes()
+                    results.append((content, bot.round_trips - round_trips))
+    (sequential, sequential_trips), (pipelined, pipelined_trips) = results
+    assert pipelined == sequential
+    assert pipelined_trips < sequential_trips
+
+def test_marker_in_content():
+    body = ["第 {} 行".format(n) for n in range(80)]
+    body[30] = "有問題可以呼叫小天使"
+    mails = [make_mail("1/01", "user1", "小天使", body)]
+    with FakeServer(lambda: FakePTT(mails), latency=0.002, split_keys=True) as server:
+        with ptt_login("user", "pass", server.host, server.port) as bot:
+            with bot.enter_mail():
+                article = bot.get_article(1)
+                # the session is still in sync
+                assert bot.get_item(1).title == "小天使"
+    lines = article.to_bytes().split(b"\r\n")
+    assert len(lines) == 84
+    assert plain_text(lines) == plain_text(mails[0].lines)
+
+class BrokenWriter(ArticleWriter):
+    """Fail before writing the second page."""
+    def write_line(self, line):
+        if self.line_count == 23:
+            raise EOFError("channel is closed")
+        super().write_line(line)
+
+def test_resume_article(mails, tmp_path):
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        with ptt_login("user", "pass", server.host, server.port) as bot:
+            with bot.enter_mail():
+                with ArticleWriter(tmp_path) as writer:
+                    bot.get_article(4, sink=writer)
+                    expected = writer.read_bytes()
+                    
+        writer = BrokenWriter(tmp_path)
+        with pytest.raises(EOFError):
+            with ptt_login("user", "pass", server.host, server.port) as bot:
+                with bot.enter_mail():
+                    bot.get_article(4, sink=writer)
+        assert writer.line_count == writer.checkpoint == 23
+        writer.__class__ = ArticleWriter
+        with ptt_login("user", "pass", server.host, server.port) as bot:
+            with bot.enter_mail():
+                with writer:
+                    bot.get_article(4, sink=writer, start_line=writer.checkpoint)
+                    assert writer.read_bytes() == expected
+
+def test_stats(mails):
+    stats = Stats()
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        with ptt_login("user", "pass", server.host, server.port, stats=stats) as bot:
+            with bot.enter_mail():
+                with bot.track_mail(4) as counter:
+                    bot.get_article(4)
+    # phases don't overlap
+    assert stats.total().round_trips == bot.round_trips
+    assert stats.phases["article"].calls == 1
+    assert stats.phases["page"].round_trips > 0
+    assert stats.mails[4].round_trips == counter.round_trips > 0
+
+def test_no_header(mails):
+    mails = mails[:7] + [Mail("1/01", "SYSOP", "沒有標頭的信", [big5("內文")], False)]
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        article, = fetch(server, [8])
+    assert article.title == "沒有標頭的信"
+    assert article.time is None
+    assert plain_text(article.to_bytes().split(b"\r\n")) == big5("內文")
+
+class SlowPTT(FakePTT):
+    """Respond to the first ``:N\\r`` in the pager after 1.5 seconds."""
+    slow = True
+
+    def on_goto(self, key):
+        out = super().on_goto(key)
+        if out and self.slow:
+            self.slow = False
+            time.sleep(1.5)
+        return out
+
+def test_slow_response(mails):
+    with FakeServer(lambda: FakePTT(mails), latency=0.01, split_keys=True) as server:
+        expected = fetch(server, [4, 5])
+    with FakeServer(lambda: SlowPTT(mails), latency=0.01, split_keys=True) as server:
+        with ptt_login("user", "pass", server.host, server.port) as bot:
+            with bot.enter_mail():
+                with bot.track_mail(4) as counter:
+                    article = bot.get_article(4)
+                # the redraw doesn't leak into later waits
+                articles = [article, bot.get_article(5)]
+    assert [a.to_bytes() for a in articles] == [a.to_bytes() for a in expected]
+    assert counter.stalls == 1
+    assert 1 <= counter.stall_seconds < 3
+    assert bot.rtt.samples > 0 and bot.rtt.timeout() == bot.rtt.min_timeout
@@ -0,0 +1,39 @@
+import pytest
+
+from ptt_mail_backup.mail_index import (
+    compare_items, filter_items, load_index, save_index
+)
+from ptt_mail_backup.ptt_bot import MailItem
+
+ITEMS = [
+    MailItem(1, "6/12", "foo", "Re: 測試"),
+    MailItem(2, "6/13", "bar", "Fw: 公告"),
+    MailItem(3, "7/01", "foo", "公告"),
+]
+
+@pytest.mark.parametrize("name", ["index.json", "index.db"])
+def test_save_load(tmp_path, name):
+    path = tmp_path / name
+    save_index(ITEMS, path)
+    assert load_index(path) == ITEMS
+
+def test_filter():
+    assert filter_items(ITEMS, sender="^foo$") == [ITEMS[0], ITEMS[2]]
+    assert filter_items(ITEMS, sender="foo", title="公告") == [ITEMS[2]]
+    assert filter_items(ITEMS, date=r"^6/") == ITEMS[:2]
+
+def test_compare_items():
+    saved = [
+        MailItem(1, "6/12", "foo", "Re: 測試"),
+        # renumbered
+        MailItem(4, "6/13", "bar", "Fw: 公告"),
+        # the full title from the file
+        MailItem(None, "7/01", "foo", "公告 很長的標題"),
+        MailItem(None, None, None, "broken.ans"),
+    ]
+    items = ITEMS + [MailItem(5, "7/02", "baz", "新信件")]
+    result = compare_items(items, saved)
+    assert result.saved == [ITEMS[0]]
+    assert result.renumbered == [(saved[1], ITEMS[1]), (saved[2], ITEMS[2])]
+    assert result.missing == [items[3]]
+    assert result.extra == [saved[3]]
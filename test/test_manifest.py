@@ -0,0 +1,34 @@
+from collections import namedtuple
+
+from ptt_mail_backup.manifest import Manifest, content_hash
+
+DummyArticle = namedtuple("DummyArticle", ["date", "sender", "title"])
+
+def add(manifest, item, filename):
+    manifest.dest.joinpath(filename).write_bytes(b"content")
+    manifest.add(item, DummyArticle(*item[1:]), content_hash(b"content"), filename)
+
+def test_match(tmp_path):
+    manifest = Manifest(tmp_path)
+    add(manifest, (1, "1/01", "foo", "title"), "1.ans")
+    manifest.save()
+
+    manifest = Manifest(tmp_path)
+    assert manifest.match((1, "1/01", "foo", "title")).filename == "1.ans"
+    assert manifest.match((1, "1/02", "foo", "title")) is None
+
+def test_shifted(tmp_path):
+    manifest = Manifest(tmp_path)
+    for i in range(1, 6):
+        add(manifest, (i, "1/01", "foo", "title {}".format(i)), "{}.ans".format(i))
+
+    # mail 1 and 2 are deleted
+    record = manifest.match((1, "1/01", "foo", "title 3"))
+    assert record.index == 3
+    
+    record = manifest.move(record, 1, "1 moved.ans")
+    assert record.index == 1
+    assert manifest.records[1] is record
+    assert 3 not in manifest.records
+    assert tmp_path.joinpath("1 moved.ans").exists()
+    assert not tmp_path.joinpath("3.ans").exists()
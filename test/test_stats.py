@@ -0,0 +1,26 @@
+import json
+
+from ptt_mail_backup.stats import Counter, Stats
+
+def test_save(tmp_path):
+    stats = Stats()
+    stats.add_phase("page", Counter(calls=1, seconds=0.5, round_trips=2))
+    stats.add_phase("page", Counter(calls=1, seconds=0.25, round_trips=1))
+    stats.add_mail(3, Counter(calls=1, seconds=1, bytes_received=100))
+    stats.add_result("saved")
+    stats.add_result("skipped", 2)
+    assert stats.total().round_trips == 3
+    assert [i for i, _c in stats.slowest_mails()] == [3]
+    
+    stats.save(tmp_path / "stats.json")
+    data = json.loads((tmp_path / "stats.json").read_text())
+    assert data["phases"]["page"]["calls"] == 2
+    assert data["phases"]["page"]["seconds"] == 0.75
+    assert data["mails"][0]["index"] == 3
+    assert (data["saved"], data["skipped"], data["failed"]) == (1, 2, 0)
+    
+    stats.save(tmp_path / "stats.prom")
+    text = (tmp_path / "stats.prom").read_text()
+    assert 'ptt_mail_backup_phase_round_trips_total{phase="page"} 3\n' in text
+    assert "ptt_mail_backup_mails_total 1\n" in text
+    assert "ptt_mail_backup_skipped_mails_total 2\n" in text
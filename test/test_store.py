@@ -0,0 +1,125 @@
+import pathlib
+import tarfile
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from ptt_mail_backup.archive import ArchiveStore, index_path, load_index, read_member
+from ptt_mail_backup.article import Article, ArticleWriter
+from ptt_mail_backup.ptt_bot import MailItem
+from ptt_mail_backup.store import BackgroundStore, SQLiteStore
+
+def write(dest, text):
+    writer = ArticleWriter(dest)
+    for line in text.split("\n"):
+        writer.write_line(line.encode("big5-uao"))
+    return writer
+
+def test_sqlite_store(tmp_path):
+    path = tmp_path / "archive.db"
+    store = SQLiteStore(path, incremental=True, batch_size=2)
+    article = Article("6/10", "user1", "測試信件", time=datetime(2018, 6, 10, 12))
+    content = "第一行\n\x1b[1;31m彩色\x1b[m文字測試"
+    store.save(write(tmp_path, content), article, 1, MailItem(1, "6/10", "user1", "測試"))
+    # the same mail fetched again with a new index
+    store.save(write(tmp_path, content), article, 2, MailItem(2, "6/10", "user1", "測試"))
+    store.save(write(tmp_path, "短信"), Article("6/11", "user2", "短"), 3)
+    store.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["archive.db"]
+    
+    store = SQLiteStore(path, incremental=True)
+    assert store.conn.execute("SELECT count(*) FROM content").fetchone() == (2,)
+    mails = store.search("彩色文字")
+    assert [(m.index, m.title, m.time) for m in mails] == [
+        (2, "測試信件", "2018-06-10T12:00:00")
+    ]
+    assert store.get_content(mails[0].hash) == content.replace("\n", "\r\n").encode("big5-uao")
+    assert [m.index for m in store.search("短信")] == [3]
+    assert store.is_saved(MailItem(5, "6/10", "user1", "測試"))
+    assert not store.is_saved(MailItem(5, "6/10", "user1", "測試2"))
+    
+    # a forwarded mail. The header shows the original author
+    forwarded = MailItem(6, "6/12", "user3", "Fw: 轉寄")
+    store.save(write(tmp_path, "轉寄"), Article("6/12", "author", "Fw: 轉寄"), 6, forwarded)
+    store.close()
+    
+    store = SQLiteStore(path, incremental=True)
+    assert store.is_saved(forwarded._replace(index=7))
+    assert forwarded in store.saved_items()
+    store.close()
+
+def test_background_store(tmp_path):
+    class SlowStore:
+        def __init__(self):
+            self.saved = []
+        def is_saved(self, _item):
+            return False
+        def save(self, writer, _article, index, _item=None):
+            with writer:
+                if index == 3:
+                    raise OSError("disk full")
+                writer.commit(tmp_path / "{}.ans".format(index))
+            self.saved.append(index)
+    inner = SlowStore()
+    store = BackgroundStore(inner, workers=2, maxsize=1)
+    for i in range(1, 6):
+        store.save(write(tmp_path, "mail {}".format(i)), None, i)
+    with pytest.raises(OSError):
+        store.join()
+    assert sorted(inner.saved) == [1, 2, 4, 5]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["1.ans", "2.ans", "4.ans", "5.ans"]
+
+@pytest.mark.parametrize("ext", [".tar", ".tar.gz", ".tar.xz", ".tar.zst", ".zip"])
+def test_archive_store(tmp_path, ext):
+    if ext == ".tar.zst":
+        pytest.importorskip("zstandard")
+    path = tmp_path / ("backup" + ext)
+    temp = tmp_path / "temp"
+    temp.mkdir()
+    contents = ["第{}封\n\x1b[1;31m彩色\x1b[m".format(i) for i in range(1, 4)]
+    def save(store, i):
+        item = MailItem(i, "6/1{}".format(i), "user{}".format(i), "測試 {}".format(i))
+        # the header shows the original author of forwarded mails
+        sender = "author" if i == 2 else item.sender
+        article = Article(item.date, sender, "測試信件 {}".format(i))
+        store.save(write(temp, contents[i - 1]), article, i, item)
+    
+    store = ArchiveStore(path, "{index}.ans", incremental=True)
+    save(store, 1)
+    save(store, 2)
+    store.close()
+    
+    store = ArchiveStore(path, "{index}.ans", incremental=True)
+    assert store.is_saved(MailItem(5, "6/12", "user2", "測試 2"))
+    assert not store.is_saved(MailItem(3, "6/13", "user3", "測試 3"))
+    assert MailItem(2, "6/12", "user2", "測試 2") in store.saved_items()
+    save(store, 3)
+    store.close()
+    assert not list(temp.iterdir())
+    
+    entries = load_index(path)
+    assert [(e.name, e.title, e.list_title) for e in entries] == [
+        ("{}.ans".format(i), "測試信件 {}".format(i), "測試 {}".format(i))
+        for i in range(1, 4)
+    ]
+    expected = [c.replace("\n", "\r\n").encode("big5-uao") for c in contents]
+    assert [read_member(path, e) for e in entries] == expected
+    if ext == ".zip":
+        with zipfile.ZipFile(str(path)) as archive:
+            assert [archive.read(n) for n in archive.namelist()] == expected
+    elif ext != ".tar.zst":
+        with tarfile.open(str(path)) as archive:
+            assert [archive.extractfile(m).read() for m in archive] == expected
+        
+    if ext != ".zip":
+        # an archive without an index is not replaced
+        size = path.stat().st_size
+        pathlib.Path(index_path(path)).unlink()
+        with pytest.raises(Exception, match="index"):
+            ArchiveStore(path, "{index}.ans", incremental=True)
+        assert path.stat().st_size == size
+        
+        # an empty archive is
+        ArchiveStore(path, "{index}.ans").close()
+        ArchiveStore(path, "{index}.ans", incremental=True).close()
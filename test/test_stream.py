@@ -1,4 +1,8 @@
-from ptt_mail_backup.ptt_bot import PTTBot
+from datetime import datetime
+
+from ptt_mail_backup.ptt_bot import (
+    AFTER_LOGIN_MARKERS, LOGIN_MARKERS, PTTBot, find_markers, parse_header
+)
 
 def test_byte_stream():
     bot = PTTBot(None)
@@ -9,3 +13,44 @@ def test_byte_stream():
 
     bot.stream.feed(b"\x1b[1;36mFOO")
     assert bot.dump_screen().strip() == "限FOO"
+
+def test_line_cache():
+    bot = PTTBot(None)
+    bot.stream.feed(b"foo\r\nbar")
+    assert bot.get_line(0).rstrip() == b"foo"
+    assert bot.get_line(1).rstrip() == b"bar"
+    
+    bot.stream.feed(b"\x1b[1;1Hbaz")
+    assert bot.get_line(0).rstrip() == b"baz"
+    assert bot.get_line(-23).rstrip() == b"bar"
+    
+    bot.stream.feed(b"\x1b[2J")
+    assert bot.get_line(0).strip() == b""
+
+def test_parse_header():
+    lines = [
+        " 作者  user1 (nick)".encode("big5-uao"),
+        " 標題  Re: 測試".encode("big5-uao"),
+        " 時間  Sun Jun 10 12:00:00 2018".encode("big5-uao"),
+    ]
+    assert parse_header(lines) == (
+        "user1", "Re: 測試", datetime(2018, 6, 10, 12), "user1 (nick)", None
+    )
+    board_lines = [" 作者  user1 (nick)  看板  Test".encode("big5-uao"), *lines[1:]]
+    assert parse_header(board_lines)[3:] == ("user1 (nick)", "Test")
+    assert parse_header(lines[1:] + [b""]) is None
+    # the title may be truncated
+    lines[1] = " 標題  ".encode("big5-uao") + b"x" * 72
+    assert parse_header(lines) is None
+
+def test_find_markers():
+    data = "\x1b[1m密碼不對喔！\x1b[m".encode("big5-uao")
+    assert find_markers(LOGIN_MARKERS, data) == {"wrong_password"}
+    assert find_markers(LOGIN_MARKERS, b"") == set()
+    
+    data = "您保存信件數目 120 超出上限 100, 請整理".encode("big5-uao")
+    assert find_markers(AFTER_LOGIN_MARKERS, data) == {"mailbox_full"}
+    data = "超出上限".encode("big5-uao")
+    assert find_markers(AFTER_LOGIN_MARKERS, data) == set()
+    data = "本日十大熱門話題 (←/q)".encode("big5-uao")
+    assert find_markers(AFTER_LOGIN_MARKERS, data) == {"view"}
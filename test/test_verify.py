@@ -0,0 +1,57 @@
+from ptt_mail_backup import build_parser, check_args, run_job
+from ptt_mail_backup.fake_server import FakePTT, FakeServer, make_mail
+
+def make_mails(count):
+    # the date in the mail list matches the header
+    return [
+        make_mail(
+            "6/{:02d}".format(i), "user{}".format(i), "測試信件 {}".format(i),
+            ["內容 {}".format(i)], time_str="Sun Jun {:02d} 12:00:00 2018".format(i)
+        )
+        for i in range(1, count + 1)
+    ]
+
+def run(server, *argv):
+    parser = build_parser()
+    args = parser.parse_args([
+        "-u", "user", "-p", "pass", "--host", server.host,
+        "--port", str(server.port), *argv
+    ])
+    check_args(parser, args)
+    return run_job(args)
+
+def test_verify(tmp_path, capsys):
+    mails = make_mails(6)
+    dest = tmp_path / "backup"
+    with FakeServer(lambda: FakePTT(mails)) as server:
+        assert run(server, "-d", str(dest), "-r", "1", "5", "-f", "{index}.ans") == 0
+        (dest / "2.ans").unlink()
+        (dest / "4.ans").rename(dest / "9.ans")
+        # converted files
+        (dest / "1.txt").write_text("內容 1", encoding="utf-8")
+        (dest / "1.html").write_text("內容 1", encoding="utf-8")
+        capsys.readouterr()
+        
+        # files without a manifest
+        assert run(server, "-d", str(dest), "--verify") == 1
+        out = capsys.readouterr().out
+        assert "Fetching mail" not in out
+        assert "Verified 6 mails: 3 saved, 2 missing, 1 renumbered, 0 extra" in out
+        assert "9 -> 4" in out
+        
+        assert run(server, "-d", str(dest), "--verify", "--fetch-missing") == 0
+        out = capsys.readouterr().out
+        assert "Fetching mail: 2\n" in out
+        assert "Fetching mail: 6\n" in out
+        assert "Fetching mail: 4\n" not in out
+        assert run(server, "-d", str(dest), "--verify", "-r", "1", "6") == 0
+        
+        # with a manifest
+        mails.pop(0)
+        manifest = tmp_path / "manifest"
+        assert run(server, "-d", str(manifest), "--all", "--incremental") == 0
+        mails.insert(0, make_mails(1)[0]._replace(title="新信件"))
+        capsys.readouterr()
+        assert run(server, "-d", str(manifest), "--verify") == 1
+        out = capsys.readouterr().out
+        assert "Verified 6 mails: 0 saved, 1 missing, 5 renumbered, 0 extra" in out
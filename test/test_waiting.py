@@ -0,0 +1,46 @@
+import socket
+import time
+
+import pytest
+
+from ptt_mail_backup.waiting import RTTEstimator, Wait
+
+def test_rtt_estimator():
+    rtt = RTTEstimator(initial=3, min_timeout=0.1, max_timeout=10)
+    assert rtt.timeout() == 3
+    for _i in range(20):
+        rtt.add_sample(0.2)
+    assert rtt.srtt == pytest.approx(0.2)
+    assert 0.2 < rtt.timeout() < 0.3
+    rtt.add_sample(2)
+    assert rtt.timeout() > 1
+    for _i in range(5):
+        rtt.add_sample(100)
+    assert rtt.timeout() == 10
+
+def test_wait():
+    rtt = RTTEstimator(initial=0.1, min_timeout=0.1)
+    wait = Wait(rtt, max_refreshes=1)
+    assert wait.recv_timeout() == pytest.approx(0.1)
+    wait.on_stall()
+    # back off
+    assert wait.recv_timeout() == pytest.approx(0.2)
+    wait.on_packet()
+    assert rtt.samples == 0
+    # drain the redraw without backing off
+    wait.settling = True
+    assert wait.recv_timeout() == pytest.approx(0.1)
+    with pytest.raises(socket.timeout):
+        wait.on_stall()
+
+    wait = Wait(rtt, refresh=False)
+    assert wait.recv_timeout() == rtt.max_timeout
+    with pytest.raises(socket.timeout):
+        wait.on_stall()
+
+    wait = Wait(rtt, deadline=0.01)
+    wait.on_packet()
+    assert rtt.samples == 1
+    time.sleep(0.02)
+    with pytest.raises(socket.timeout):
+        wait.recv_timeout()